@@ -5,6 +5,7 @@ from .util.constants import BASE_URL_PREFIX
 sys.path.append(".")
 
 from flask import Blueprint
+from flask_jwt_extended.exceptions import UserLookupError
 from flask_restx import Api, Resource
 from .ns_recipe import api as api_recipe, ENDPOINT as RECIPE_ENDPOINT
 from .ns_user import api as api_user, ENDPOINT as USER_ENDPOINT
@@ -21,6 +22,9 @@ from .ns_goals import api as api_fitness, ENDPOINT as ENDPOINT_FITNESS
 
 from .admin.ns_user import api as api_admin_user, ENDPOINT as USER_ADMIN_ENDPOINT
 
+from ...ext.jwt import revoke_token
+from ...ext.logger import log
+
 # Here you create the API path
 
 
@@ -53,6 +57,15 @@ api.add_namespace(api_admin_company, path=ENDPOINT_ADMIN)
 api.add_namespace(api_admin_user, path=f"{ADMIN_ENDPOINT}{USER_ADMIN_ENDPOINT}")
 
 
+@api.errorhandler(UserLookupError)
+def handle_user_not_found(error):
+    # Otherwise block user token (user cant be logged in and still reach this far)
+    # this only occurs when accounts are not in db
+    revoke_token(error.jwt_data)
+    log.error("User couldn't be found by this id.")
+    return {"message": "User couldn't be found by this id."}, 400
+
+
 
 def init_app(app):
     app.register_blueprint(bp)
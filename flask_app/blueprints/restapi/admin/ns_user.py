@@ -4,13 +4,16 @@ from datetime import datetime, timezone
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import jwt_required, get_jwt, current_user
 from flask_restx import Namespace, Resource
 from playhouse.shortcuts import model_to_dict
 
 from ..errors import return_error_sql
 from ....classes.models import User as UserDB
 from ....classes.schemas import *
+from ....classes.search import index_user
+from ....ext.cache import response_cache, user_tag, USER_LISTS, RECIPE_LISTS
+from ....ext.jwt import invalidate_user
 from ....ext.logger import log
 
 # Create name space
@@ -38,10 +41,6 @@ class UserResource(Resource):
 
         log.info("DELETE /user")
 
-        # gets user auth id
-
-        user_logged_id = get_jwt_identity()
-
         # get args
 
         args = parser.parse_args()
@@ -49,16 +48,7 @@ class UserResource(Resource):
         id = args['id']
 
         # check if user exists
-        try:
-            user_logged = UserDB.get(user_logged_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response="User couldn't be found by this id.")
+        user_logged = current_user
 
         # check if user exists
         try:
@@ -75,6 +65,8 @@ class UserResource(Resource):
         if user_logged.user_type == USER_TYPE.ADMIN.value:
             try:
                 user_to_be_deleted.delete_instance(recursive=True)
+                response_cache.invalidate(user_tag(user_to_be_deleted.id), USER_LISTS, RECIPE_LISTS)
+                invalidate_user(user_to_be_deleted.id)
                 log.info("Finished DELETE /user")
                 return Response(status=200, response="User deleted successfully.")
             except peewee.IntegrityError as e:
@@ -89,18 +81,10 @@ class UserResource(Resource):
         log.info("PATCH /user")
 
         # gets user auth id
-        user_id = get_jwt_identity()
 
-        # check if user exists
-        try:
-            user_making_patch = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
+        # check if user exists, read again since current_user may come from the cache of this worker
+        user_making_patch = UserDB.get_or_none(UserDB.id == current_user.id)
+        if user_making_patch is None:
             return Response(status=400, response="User couldn't be found by this id.")
 
         # get data from json
@@ -115,10 +99,17 @@ class UserResource(Resource):
 
         try:
             for key, value in user_validated.items():
+                if key == "password":
+                    value = user_making_patch.hash_password(value)
                 setattr(user_making_patch, key, value)
 
             user_making_patch.updated_date = datetime.now(timezone.utc)
-            user_making_patch.save()
+            # only the patched columns, a concurrent change to the others is kept
+            user_making_patch.save(only=user_making_patch.dirty_fields)
+            if 'username' in user_validated or 'name' in user_validated:
+                index_user(user_making_patch)
+            response_cache.invalidate(user_tag(user_making_patch.id))
+            invalidate_user(user_making_patch.id)
 
             log.info("Finished PATCH /user")
             return Response(status=200, response=json.dumps(
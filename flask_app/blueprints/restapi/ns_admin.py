@@ -1,9 +1,8 @@
 import json
 from datetime import date
 
-import peewee
 from flask import Response, Blueprint, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 from marshmallow import ValidationError
 
 from flask_app.ext.database import db
@@ -11,9 +10,12 @@ from flask_restx import Resource, Namespace
 
 from ...classes.functions import block_user_session_id
 from ...classes.schemas import UserSchema
+from ...classes.search import index_user
 
 from ...classes.models import User as UserDB, USER_TYPE, PROFILE_TYPE
 
+from ...ext.cache import response_cache, USER_LISTS
+from ...ext.bycrypt import hash_password
 from ...ext.logger import log
 
 
@@ -40,10 +42,6 @@ class CompanyUserResource(Resource):
 
         json_data = request.get_json()
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Validate args by loading it into schema
 
         try:
@@ -63,17 +61,16 @@ class CompanyUserResource(Resource):
 
         # Verify existence of the requested ids model's
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            return Response(status=400, response="Client couldn't be found.")
+        user = current_user
 
         # Verify if user is admin
 
         if user.user_type != USER_TYPE.ADMIN.value:
             return Response(status=403)
 
-        # fills db objects
+        # fills db objects, the password is only hashed once the account can be created
+
+        data['password'] = hash_password(data['password'])
 
         try:
             user = UserDB(**data)
@@ -90,6 +87,8 @@ class CompanyUserResource(Resource):
 
         # commit them
         user.save()
+        index_user(user)
+        response_cache.invalidate(USER_LISTS)
 
         log.info("Finished POST /auth")
         return Response(status=201)
@@ -1,15 +1,21 @@
 import json
 from datetime import date
-from datetime import timedelta, datetime, timezone
 
 from flask import Response, Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 from peewee import DoesNotExist, IntegrityError
 
-from ...classes.models import TokenBlocklist, User as UserDB, RECIPES_BACKGROUND_TYPE
-from ...classes.schemas import LoginSchema, RecipeSchema, UserSchema
+from ...classes.hydration import hydrate_recipes
+from ...classes.models import User as UserDB, Recipe as RecipeDB, RecipeBackground as RecipeBackgroundDB, \
+    RECIPES_BACKGROUND_TYPE
+from ...classes.pagination import keyset_paginate, InvalidCursor
+from ...classes.search import index_user
+from ...classes.schemas import LoginSchema, UserSchema, build_cursor_metadata, recipe_projection
+from ...ext.cache import response_cache, USER_LISTS
+from ...ext.bycrypt import hash_password, needs_rehash
+from ...ext.jwt import revoke_token, invalidate_user, LOGIN_EXPIRES
 from ...ext.logger import log
 
 # Create blue print
@@ -35,6 +41,20 @@ auth_json_schema = {
 }
 
 
+def taken_user_fields(data):
+    """ The errors of a registration whose username or email is already used, before hashing its password """
+
+    msg = {}
+    for user in UserDB.select(UserDB.username, UserDB.email).where(
+            (UserDB.username == data['username']) | (UserDB.email == data['email'])):
+        # the columns collation ignores case
+        if user.username.lower() == data['username'].lower():
+            msg["username"] = ["Username is already being used."]
+        if user.email.lower() == data['email'].lower():
+            msg["email"] = ["Email is already being used."]
+    return msg
+
+
 @api.route('/login')
 class login_user(Resource):
 
@@ -66,10 +86,15 @@ class login_user(Resource):
             log.error("Password incorrect.")
             return Response(status=400, response={'Password incorrect.'})
 
+        # hashes made with an older work factor are upgraded while the password is at hand
+        if needs_rehash(user.password):
+            user.password = user.hash_password(data['password'])
+            user.save(only=[UserDB.password])
+            invalidate_user(user.id)
+
         # create new
 
-        expires = timedelta(days=7)
-        access_token = create_access_token(identity=user.id, expires_delta=expires)
+        access_token = create_access_token(identity=user.id, expires_delta=LOGIN_EXPIRES)
         response = {'token': access_token}
         log.info("Finished POST /auth/login")
         return Response(status=200, response=json.dumps(response), mimetype="application/json")
@@ -94,6 +119,13 @@ class UserAuthResource(Resource):
         except ValidationError as err:
             return Response(status=400, response=json.dumps({"errors":err.messages}), mimetype="application/json")
 
+        # the password is only hashed once the account can be created
+
+        msg = taken_user_fields(data)
+        if msg:
+            return Response(status=400, response=json.dumps({"errors":msg}), mimetype="application/json")
+
+        data['password'] = hash_password(data['password'])
 
         # fills db objects
 
@@ -107,7 +139,7 @@ class UserAuthResource(Resource):
             log.error(e)
             return Response(status=400, response=json.dumps(e), mimetype="application/json")
 
-        # commit them
+        # commit them, another registration may still take the username or email first
         try:
             user.save()
         except IntegrityError as e:
@@ -119,6 +151,9 @@ class UserAuthResource(Resource):
 
             return Response(status=400, response=json.dumps({"errors":msg}), mimetype="application/json")
 
+        index_user(user)
+        response_cache.invalidate(USER_LISTS)
+
         log.info("Finished POST /auth")
         return Response(status=201)
 
@@ -128,20 +163,9 @@ class UserAuthResource(Resource):
         # gets user auth id
 
         log.info("GET /auth")
-        user_id = get_jwt_identity()
 
         # query
-        try:
-            user_record = UserDB.get(user_id)
-        except DoesNotExist as e:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user_record = current_user
 
         userSchema = UserSchema().dump(user_record)
 
@@ -154,54 +178,103 @@ class UserAuthResource(Resource):
     def delete():
         log.info("DELETE /auth/logout")
 
-        jti = get_jwt()["jti"]
-        now = datetime.now(timezone.utc)
-        token_block_record = TokenBlocklist(jti=jti, created_at=now)
-        token_block_record.save()
+        revoke_token(get_jwt())
 
         log.info("DELETE /auth/logout")
         return Response(status=204)
 
+
+AUTH_RECIPE_SECTIONS = {"created": "recipes_created", "liked": "recipes_liked", "saved": "recipes_saved"}
+# ids are small, a client syncing its lists can read them in fewer pages
+IDS_MAX_PAGE_SIZE = 1000
+
+recipes_parser = api.parser()
+recipes_parser.add_argument('section', type=str, help='created, liked or saved. All three when missing, first page only.')
+recipes_parser.add_argument('cursor', type=str, help='Opaque cursor of the next page of section.')
+recipes_parser.add_argument('page_size', type=int, help='The page size of each section.')
+recipes_parser.add_argument('ids_only', type=inputs.boolean, default=False, help='true sends the recipe ids only.')
+recipes_parser.add_argument('view', type=str, help='card or full (default), the recipe fields sent.')
+recipes_parser.add_argument('fields', type=str, help='Comma separated recipe fields to send, overrides view.')
+
+
+def auth_recipes_query(section, user, columns):
+    """ The recipes of a section of the user with its sort keys, the liked and saved ones in a single join """
+
+    if section == "created":
+        query = RecipeDB.select(*columns).where(RecipeDB.created_by == user)
+        return query, [(RecipeDB.id, True)]
+
+    background_type = RECIPES_BACKGROUND_TYPE.LIKED.value if section == "liked" else RECIPES_BACKGROUND_TYPE.SAVED.value
+    query = (RecipeDB.select(*columns)
+             .join(RecipeBackgroundDB, on=(RecipeBackgroundDB.recipe == RecipeDB.id))
+             .where((RecipeBackgroundDB.user == user) & (RecipeBackgroundDB.type == background_type))
+             # the cursor keys of the joined row are read from the recipe
+             .objects())
+    # last liked or saved first
+    return query, [(RecipeBackgroundDB.id, True)]
+
+
 @api.route('/recipes')
 class UserAuthResource(Resource):
     @staticmethod
     @jwt_required()
     def get():
 
-        log.info("GET /auth")
+        log.info("GET /auth/recipes")
+
+        args = recipes_parser.parse_args()
+
+        section = args['section']
+        cursor = args['cursor']
+        ids_only = args['ids_only']
+        page_size = int(args['page_size']) if args['page_size'] else 10
 
+        # validate args
+
+        if section and section not in AUTH_RECIPE_SECTIONS:
+            return Response(status=400, response=f"section must be one of {', '.join(AUTH_RECIPE_SECTIONS)}.")
+        if cursor and not section:
+            return Response(status=400, response="A cursor needs its section.")
+        if ids_only and not 0 < page_size <= IDS_MAX_PAGE_SIZE:
+            return Response(status=400, response=f"page_size must be between 1 and {IDS_MAX_PAGE_SIZE}")
+        if not ids_only and page_size not in [5, 10, 20, 40]:
+            log.error("page_size not in [5, 10, 20, 40]")
+            return Response(status=400, response="page_size not in [5, 10, 20, 40]")
+
+        # fields sent and columns read
+
+        if ids_only:
+            schema, columns, relations = None, [RecipeDB.id], ()
+        else:
+            try:
+                schema, columns, relations = recipe_projection(args['view'], args['fields'])
+            except ValueError as e:
+                return Response(status=400, response=str(e))
 
         # Get auth User
 
-        try:
-            user_record = UserDB.get(get_jwt_identity())
-        except DoesNotExist as e:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
-
-        created = []
-        liked = []
-        saved = []
-
-        recipe_schema = RecipeSchema()
-
-        for item in user_record.recipes:
-            if item.type == RECIPES_BACKGROUND_TYPE.LIKED.value:
-                liked.append(recipe_schema.dump(item.recipe))
-            if item.type == RECIPES_BACKGROUND_TYPE.SAVED.value:
-                saved.append(recipe_schema.dump(item.recipe))
-
-        for item in user_record.created_recipes:
-            created.append(recipe_schema.dump(item))
-
-        response_holder = {"result": {'recipes_created': created, 'recipes_liked': liked, 'recipes_saved': saved}}
+        user_record = current_user
 
-        log.info("GET /auth")
-        return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
+        response_holder = {"_metadata": {}, "result": {}}
+
+        for name in [section] if section else AUTH_RECIPE_SECTIONS:
+            key = AUTH_RECIPE_SECTIONS[name]
+            query, sort_keys = auth_recipes_query(name, user_record, columns)
+
+            try:
+                page_query, next_cursor = keyset_paginate(query, sort_keys, cursor, page_size, scope=f"auth:{name}")
+            except InvalidCursor as e:
+                return Response(status=400, response=str(e))
 
+            if ids_only:
+                response_holder["result"][key] = [recipe.id for recipe in page_query]
+            else:
+                response_holder["result"][key] = [schema.dump(recipe) for recipe in hydrate_recipes(page_query, relations)]
+
+            _metadata = build_cursor_metadata(page_size, next_cursor, ENDPOINT + "/recipes")
+            if next_cursor:
+                _metadata['next'] += f"&section={name}&ids_only={str(ids_only).lower()}"
+            response_holder["_metadata"][key] = _metadata
+
+        log.info("Finished GET /auth/recipes")
+        return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
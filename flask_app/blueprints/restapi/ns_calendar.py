@@ -4,14 +4,15 @@ from datetime import datetime, timezone, timedelta
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 
 from ...classes.functions import parse_date, add_days
-from ...classes.models import Recipe as RecipeDB, User as UserDB, \
+from ...classes.models import Recipe as RecipeDB, \
     CalendarEntry, TokenBlocklist, RecipeIngredientQuantity, Recipe
-from ...classes.schemas import build_metadata, \
+from ...classes.pagination import offset_paginate
+from ...classes.schemas import build_page_metadata, \
     CalendarEntrySimpleSchema, \
     ShoppingIngredient, CalendarEntrySchema, ShoppingIngredientSchema, CalenderEntryListUpdateSchema
 from ...ext.logger import log
@@ -24,6 +25,8 @@ api = Namespace("calendar", description="Here are all comment endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument('id', type=int, help='The id to be search.')
 parser.add_argument('date', type=str, help='The date.')
 parser.add_argument('from_date', type=str, help='The left date delimiter.')
@@ -108,15 +111,13 @@ class CalendarResource(Resource):
 
         # metadata
 
-        total_calender_entrys = int(query.count())
-        total_pages = math.ceil(total_calender_entrys / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_calender_entrys, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_calender_entrys, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_calender_entrys, has_next, ENDPOINT)
 
         # response data
 
         calendar_entrys = []
-        for item in query.paginate(page, page_size):
+        for item in page_query:
             calendar_entry = item
             calendar_entrys.append(CalendarEntrySchema().dump(calendar_entry))
 
@@ -162,10 +163,6 @@ class CalendarResource(Resource):
 
         log.info("POST /calendar")
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Parse json body
 
         json_data = request.get_json()
@@ -192,17 +189,7 @@ class CalendarResource(Resource):
 
         # Verify existence of the requested ids model's
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="Client couldn't be found.")
+        user = current_user
 
         try:
             recipe = RecipeDB.get(recipe_id)
@@ -332,16 +319,7 @@ class CalendarResource(Resource):
         user_logged_id = get_jwt_identity()
 
         # check if user exists
-        try:
-            user_logged = UserDB.get(user_logged_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response="User couldn't be found by this id.")
+        user_logged = current_user
 
         # validate args
 
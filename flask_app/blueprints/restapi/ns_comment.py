@@ -4,12 +4,15 @@ from datetime import datetime, timezone, timedelta
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 
-from ...classes.models import TokenBlocklist, Comment as CommentDB, Recipe as RecipeDB, User as UserDB
-from ...classes.schemas import CommentSchema, build_metadata
+from ...classes.hydration import hydrate_users
+from ...classes.models import TokenBlocklist, Comment as CommentDB, Recipe as RecipeDB, User as UserDB, db
+from ...classes.pagination import keyset_paginate, keyset_order, InvalidCursor, offset_paginate
+from ...classes.schemas import CommentSchema, build_page_metadata, build_cursor_metadata
+from ...ext.cache import response_cache, recipe_tag, recipe_list_tag
 from ...ext.logger import log
 
 # Create name space
@@ -20,9 +23,12 @@ api = Namespace("Comments", description="Here are all comment endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument('id', type=int, help='The id to be search.')
 parser.add_argument('recipe_id', type=int, help='The recipe id to be search.')
 parser.add_argument('user_id', type=int, help='The user id to be search.')
+parser.add_argument('cursor', type=str, help='Opaque cursor for keyset pagination, empty for the first page.')
 
 ENDPOINT = "/comment"
 
@@ -44,6 +50,7 @@ class CommentsListResource(Resource):
         client_id = args.get('client_id')
         page = int(args['page']) if args['page'] else 1
         page_size = int(args['page_size']) if args['page_size'] else 10
+        cursor = args['cursor']
 
         # validate args
 
@@ -60,7 +67,9 @@ class CommentsListResource(Resource):
 
         # build query
 
-        query = CommentDB.select().order_by(CommentDB.updated_date.desc())
+        sort_keys = [(CommentDB.updated_date, True), (CommentDB.id, True)]
+
+        query = CommentDB.select(CommentDB, UserDB).join(UserDB).order_by(*keyset_order(sort_keys))
 
         if recipe_id:
             # build query
@@ -72,17 +81,31 @@ class CommentsListResource(Resource):
 
             query = query.where(CommentDB.user == client_id)
 
-        # metadata
+        if cursor is not None:
+
+            # keyset pagination
+
+            try:
+                page_query, next_cursor = keyset_paginate(query, sort_keys, cursor, page_size)
+            except InvalidCursor as e:
+                return Response(status=400, response=str(e))
+
+            response_holder["_metadata"] = build_cursor_metadata(page_size, next_cursor, ENDPOINT)
 
-        total_comments = int(query.count())
-        total_pages = math.ceil(total_comments / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_comments, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        else:
+
+            # metadata
+
+            page_query, total_comments, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_comments, has_next, ENDPOINT)
 
         # response data
 
+        page_comments = list(page_query)
+        hydrate_users([item.user for item in page_comments])
+
         comments = []
-        for item in query.paginate(page, page_size):
+        for item in page_comments:
             comments.append(CommentSchema().dump(item))
 
         response_holder["result"] = comments
@@ -142,10 +165,6 @@ class CommentResource(Resource):
             log.error("Missing arguments...")
             return Response(status=400, response="Missing arguments...")
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Validate args by loading it into schema
 
         try:
@@ -156,17 +175,7 @@ class CommentResource(Resource):
 
         # Verify existence of the requested ids model's
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="Client couldn't be found.")
+        user = current_user
 
         try:
             recipe = RecipeDB.get(recipe_id)
@@ -180,7 +189,12 @@ class CommentResource(Resource):
         comment = CommentDB(**comment_validated)
         comment.recipe = recipe
         comment.user = user
-        comment.save()
+
+        with db.atomic():
+            comment.save()
+            RecipeDB.update_counters(recipe.id, comments_count=1)
+
+        response_cache.invalidate(recipe_tag(recipe.id), recipe_list_tag(f"commented_by:{user.id}"))
 
         # prepares object to be returned
 
@@ -269,16 +283,7 @@ class CommentResource(Resource):
         log.info("DELETE /comment")
 
         # gets user auth id
-        user_auth_id = get_jwt_identity()
-        try:
-            user = UserDB.get(user_auth_id)
-        except peewee.DoesNotExist:
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="No user found by this id.")
+        user = current_user
 
         # Get args
         args = parser.parse_args()
@@ -300,7 +305,10 @@ class CommentResource(Resource):
         # checks if user is admin or the one who created the comment and deletes the comment
 
         try:
-            comment.delete_instance()
+            with db.atomic():
+                comment.delete_instance()
+                RecipeDB.update_counters(comment.recipe_id, comments_count=-1)
+            response_cache.invalidate(recipe_tag(comment.recipe_id), recipe_list_tag(f"commented_by:{comment.user_id}"))
             log.info("Finished DELETE /comment")
             return Response(status=200, response="Comment deleted successfully.")
         except peewee.DoesNotExist:
@@ -1,16 +1,20 @@
 import json
 import math
-from datetime import datetime, timezone
 
 import peewee
 from flask import Response
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity, current_user
+from flask_restx import Namespace, Resource, inputs
+from peewee import fn, SQL
 
 from ...classes.functions import push_notification
-from ...classes.models import TokenBlocklist, Comment as CommentDB, Follow as FollowDB, User as UserDB, PROFILE_TYPE, \
+from ...classes.models import Comment as CommentDB, Follow as FollowDB, User as UserDB, PROFILE_TYPE, \
     FollowRequest as FollowRequestDB, NOTIFICATION_TYPE, USER_TYPE
-from ...classes.schemas import CommentSchema, build_metadata, UserSimpleSchema, UserToFollow
+from ...classes.pagination import keyset_paginate, keyset_order, InvalidCursor, offset_paginate
+from ...classes.search import user_match
+from ...classes.schemas import CommentSchema, build_page_metadata, UserSimpleSchema, UserToFollow, build_cursor_metadata, \
+    USER_SIMPLE_COLUMNS
+from ...ext.cache import response_cache, user_tag
 from ...ext.logger import log
 
 # Create name space
@@ -21,16 +25,58 @@ api = Namespace("Follows", description="Here are all comment endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument('id', type=int, help='The id to be search.')
 parser.add_argument('searchString', type=str, help='The id to be search.')
 parser.add_argument('user_id', type=int, help='The user id to be search.')
 parser.add_argument('user_follower_id', type=int, help='The user id to be search.')
 parser.add_argument('user_followed_id', type=int, help='The user id to be search.')
 parser.add_argument('follow_request_id', type=int, help='The user id to be search.')
+parser.add_argument('cursor', type=str, help='Opaque cursor for keyset pagination, empty for the first page.')
+
+# newest follows first, ending in a unique column so they can seed a cursor
+FOLLOW_SORT_KEYS = [(FollowDB.created_date, True), (FollowDB.id, True)]
+FOLLOW_REQUEST_SORT_KEYS = [(FollowRequestDB.created_date, True), (FollowRequestDB.id, True)]
 
 ENDPOINT = "/follow"
 
 
+def invalidate_follow(follow):
+    """ Drops the cached responses showing the follow counters of both users of a Follow or FollowRequest """
+    response_cache.invalidate(user_tag(follow.follower_id), user_tag(follow.followed_id))
+
+
+def follow_users_query(user_column, listed_by, user_id):
+    """
+    The users at user_column of the Follow or FollowRequest rows whose listed_by column is user_id, e.g. the
+    followers of a user are follow_users_query(FollowDB.follower, FollowDB.followed, user_id). A single join
+    reading only the UserSimpleSchema columns.
+    """
+
+    through = user_column.model
+    return (UserDB.select(*USER_SIMPLE_COLUMNS)
+            .join(through, on=(user_column == UserDB.id))
+            .where(listed_by == user_id)
+            # the cursor keys of the joined row are read from the user
+            .objects())
+
+
+def follow_users_page(query, sort_keys, args, page, page_size, endpoint, scope):
+    """ A page of follow_users_query, by cursor when one is given, and its _metadata """
+
+    if args['cursor'] is not None:
+        page_query, next_cursor = keyset_paginate(query, sort_keys, args['cursor'], page_size, scope=scope)
+        _metadata = build_cursor_metadata(page_size, next_cursor, endpoint)
+        if next_cursor and args['user_id']:
+            _metadata['next'] += f"&user_id={args['user_id']}"
+        return page_query, _metadata
+
+    page_query, total, has_next = offset_paginate(query.order_by(*keyset_order(sort_keys)), page, page_size,
+                                                  args['include_total'])
+    return page_query, build_page_metadata(page, page_size, total, has_next, endpoint)
+
+
 @api.route("/find")
 class FollowsListResource(Resource):
 
@@ -60,25 +106,28 @@ class FollowsListResource(Resource):
             log.error("page_size not in [5, 10, 20, 40]")
             return Response(status=400, response="page_size not in [5, 10, 20, 40]")
 
-        # query
+        # query, with the follow state of each user towards the logged one read in the same statement
 
-        query = UserDB.select().where(((UserDB.user_type != USER_TYPE.ADMIN.value) & (UserDB.id != user_logged_id)))
+        request_sent = fn.EXISTS(FollowRequestDB.select(SQL('1')).where(
+            (FollowRequestDB.follower == user_logged_id) & (FollowRequestDB.followed == UserDB.id)))
+        follower = fn.EXISTS(FollowDB.select(SQL('1')).where(
+            (FollowDB.follower == UserDB.id) & (FollowDB.followed == user_logged_id)))
 
-        if args['searchString'] and args['searchString'] != "":
-            query = (query
-                     .where((UserDB.name.contains(args['searchString'])) | (UserDB.id == args['searchString'])))
+        query = (UserDB.select(UserDB, request_sent.alias('request_sent'), follower.alias('follower'))
+                 .where(((UserDB.user_type != USER_TYPE.ADMIN.value) & (UserDB.id != user_logged_id))))
 
-        # query for follow request
-        query_helper = FollowRequestDB.select(FollowRequestDB.followed).where(
-            FollowRequestDB.follower == user_logged_id)
+        if args['searchString'] and args['searchString'] != "":
+            condition = user_match(args['searchString'])
+            if args['searchString'].isdigit():
+                condition = (UserDB.id == int(args['searchString'])) | condition
 
-        follow_requests_ids = [item.followed.id for item in query_helper]
+            if condition is None:
+                log.error("Search string has no words")
+                return Response(status=400, response="Search string has no words")
 
-        # query for follows
-        query_helper = FollowDB.select().where(
-            FollowDB.followed == user_logged_id)
+            query = query.where(condition)
 
-        follows_ids = [item.follower.id for item in query_helper]
+        query = query.order_by(UserDB.username)
 
         # declare response holder
 
@@ -86,21 +135,16 @@ class FollowsListResource(Resource):
 
         # metadata
 
-        total_comments = int(query.count())
-        total_pages = math.ceil(total_comments / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_comments, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_comments, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_comments, has_next, ENDPOINT)
 
         # response data
 
         response_holder["result"] = []
 
-        for item in query.paginate(page, page_size):
-            request_sent = item.id in follow_requests_ids
-            follower = item.id in follows_ids
-
-            response_holder["result"].append(
-                UserToFollow().dump({"user": item, "request_sent": request_sent, "follower": follower}))
+        for item in page_query:
+            response_holder["result"].append(UserToFollow().dump(
+                {"user": item, "request_sent": bool(item.request_sent), "follower": bool(item.follower)}))
 
         log.info("Finish GET /find")
         return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
@@ -143,22 +187,17 @@ class FollowersResource(Resource):
 
         # build query
 
-        query = FollowDB.select().where(FollowDB.followed == user_id)
-
-        # metadata
+        query = follow_users_query(FollowDB.follower, FollowDB.followed, user_id)
 
-        total_followers = int(query.count())
-        total_pages = math.ceil(total_followers / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_followers, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        try:
+            page_query, response_holder["_metadata"] = follow_users_page(
+                query, FOLLOW_SORT_KEYS, args, page, page_size, ENDPOINT + "/list/followers", "followers")
+        except InvalidCursor as e:
+            return Response(status=400, response=str(e))
 
         # response data
 
-        followers = []
-        for item in query.paginate(page, page_size):
-            followers.append(UserSimpleSchema().dump(item.follower))
-
-        response_holder["result"] = followers
+        response_holder["result"] = UserSimpleSchema(many=True).dump(page_query)
 
         log.info("Finish GET /follow/list/followers")
         return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
@@ -199,22 +238,17 @@ class FollowersResource(Resource):
 
         # build query
 
-        query = FollowDB.select().where(FollowDB.follower == user_id)
+        query = follow_users_query(FollowDB.followed, FollowDB.follower, user_id)
 
-        # metadata
-
-        total_followers = int(query.count())
-        total_pages = math.ceil(total_followers / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_followers, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        try:
+            page_query, response_holder["_metadata"] = follow_users_page(
+                query, FOLLOW_SORT_KEYS, args, page, page_size, ENDPOINT + "/list/followeds", "followeds")
+        except InvalidCursor as e:
+            return Response(status=400, response=str(e))
 
         # response data
 
-        followers = []
-        for item in query.paginate(page, page_size):
-            followers.append(UserSimpleSchema().dump(item.followed))
-
-        response_holder["result"] = followers
+        response_holder["result"] = UserSimpleSchema(many=True).dump(page_query)
 
         return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
 
@@ -285,17 +319,7 @@ class FollowResource(Resource):
             log.error("User to be followed, couln't be found.")
             return Response(status=400, response="User to be followed, couln't be found.")
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         # fills comment object
 
@@ -305,6 +329,8 @@ class FollowResource(Resource):
                 log.error("User already follows this account.")
                 return Response(status=400, response="User already follows this account.")
 
+            invalidate_follow(follow_request)
+
             # send new follow request notification to recipient
             push_notification(reciever_user=user_to_be_followed,
                               notification_type=NOTIFICATION_TYPE.FOLLOW_REQUEST.value)
@@ -314,6 +340,8 @@ class FollowResource(Resource):
 
         else:
             follow, created = FollowDB.get_or_create(follower=user, followed=user_to_be_followed)
+            if created:
+                invalidate_follow(follow)
 
             # send new follow notification to recipient
             push_notification(reciever_user=user_to_be_followed,
@@ -357,6 +385,7 @@ class FollowResource(Resource):
                 return Response(status=400, response="User does not follow referenced account.")
 
             follow.delete_instance()
+            invalidate_follow(follow)
 
         # delete followed
         else:
@@ -367,6 +396,7 @@ class FollowResource(Resource):
                 return Response(status=400, response="User does not follow referenced account.")
 
             follow.delete_instance()
+            invalidate_follow(follow)
 
         log.info("Finish DELETE /follow")
         return Response(status=200)
@@ -419,6 +449,7 @@ class FollowAcceptResource(Resource):
         # delete the request
 
         follow_request.delete_instance()
+        invalidate_follow(follow)
 
         log.info("Finish POST /requests")
 
@@ -466,6 +497,7 @@ class FollowAcceptResource(Resource):
                 return Response(status=400, response="User does not follow referenced account.")
 
         follow.delete_instance()
+        invalidate_follow(follow)
 
         log.info("Finish DELETE /requests")
         return Response(status=200)
@@ -504,22 +536,17 @@ class FollowAcceptResource(Resource):
 
         # build query
 
-        query = FollowRequestDB.select().where(FollowRequestDB.followed == user_id)
+        query = follow_users_query(FollowRequestDB.follower, FollowRequestDB.followed, user_id)
 
-        # metadata
-
-        total_followers = int(query.count())
-        total_pages = math.ceil(total_followers / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_followers, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        try:
+            page_query, response_holder["_metadata"] = follow_users_page(
+                query, FOLLOW_REQUEST_SORT_KEYS, args, page, page_size, ENDPOINT + "/requests/list", "follow_requests")
+        except InvalidCursor as e:
+            return Response(status=400, response=str(e))
 
         # response data
 
-        followers = []
-        for item in query.paginate(page, page_size):
-            followers.append(UserSimpleSchema().dump(item.follower))
-
-        response_holder["result"] = followers
+        response_holder["result"] = UserSimpleSchema(many=True).dump(page_query)
 
         log.info("Finish GET /accept/list")
         return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
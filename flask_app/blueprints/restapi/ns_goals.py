@@ -1,14 +1,12 @@
 import json
 import re
-from datetime import datetime, timezone
 from enum import Enum
 
-import peewee
 import requests
 from bs4 import *
 from flask import Response, request
-from flask_jwt_extended import get_jwt_identity
-from flask_jwt_extended import jwt_required, get_jwt
+from flask_jwt_extended import current_user
+from flask_jwt_extended import jwt_required
 from flask_restful import reqparse
 from flask_restx import Namespace, Resource
 from marshmallow import ValidationError
@@ -17,8 +15,9 @@ from ...classes.constants import ERROR_BIODATA_WEIGHT, ERROR_BIODATA_HEIGHT, ERR
     ERROR_BIODATA_ACTIVITY_LEVEL
 from ...classes.enums import USER_SEXES_TYPE
 from ...classes.functions import calculate_age
-from ...classes.models import User as UserDB, TokenBlocklist, Goal as GoalDB
+from ...classes.models import Goal as GoalDB
 from ...classes.schemas import LimitsSchema, GoalSchema, FitnessReport
+from ...ext.cache import response_cache, user_tag
 from ...ext.logger import log
 
 ACTIVIDADE = {
@@ -77,17 +76,7 @@ class Goal(Resource):
 
         # Get auth User
 
-        try:
-            user = UserDB.get(get_jwt_identity())
-        except peewee.DoesNotExist as e:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         # Check if user dont have any current goal
         # if he does delete it
@@ -102,6 +91,9 @@ class Goal(Resource):
             log.error(e)
             return Response(status=400, response=json.dumps(e), mimetype="application/json")
 
+        # the cached user responses show the goal in use
+        response_cache.invalidate(user_tag(user.id))
+
         log.info("Finished POST /auth")
         return Response(status=201, response=json.dumps(GoalSchema().dump(goal)), mimetype="application/json")
 
@@ -112,22 +104,16 @@ class Goal(Resource):
         log.info("DELETE /comment")
 
         """ Get Auth User"""
-        try:
-            user = UserDB.get(get_jwt_identity())
-        except peewee.DoesNotExist:
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="No user found by this id.")
+        user = current_user
 
-        goal = user.goal
-
-        user.goal = None
-        user.save()
+        # the goal in use is the last one created, the user row itself holds no goal and isn't written
+        goal = GoalDB.select().where(GoalDB.user == user).order_by(GoalDB.id.desc()).first()
+        if goal is None:
+            log.error("User has no goal.")
+            return Response(status=400, response="User has no goal.")
 
         goal.delete_instance()
+        response_cache.invalidate(user_tag(user.id))
 
         log.info("Finished DELETE /comment")
         return Response(status=200)
@@ -424,19 +410,9 @@ class Weight(Resource):
     def get(self):
 
         """ gets user auth id """
-        user_logged_id = get_jwt_identity()
 
         """ check if user exist """
-        try:
-            user_logged = UserDB.get(user_logged_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response="User couldn't be found by this id.")
+        user_logged = current_user
 
         return Response(status=200, response=json.dumps(
             get_peso(user_logged.height, calculate_age(user_logged.birth_date), user_logged.sex)),
@@ -450,19 +426,9 @@ class FullModel(Resource):
     def get(self):
 
         """ gets user auth id """
-        user_logged_id = get_jwt_identity()
 
         """ check if user exist """
-        try:
-            user_logged = UserDB.get(user_logged_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response="User couldn't be found by this id.")
+        user_logged = current_user
 
         height = user_logged.height
         weight = user_logged.weight
@@ -1,13 +1,11 @@
 import json
 
-import peewee
 from flask import Response, Blueprint, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, current_user
 from flask_restx import Resource, Namespace
 from marshmallow import ValidationError
 
-from ...classes.functions import block_user_session_id
-from ...classes.models import User as UserDB, Recipe as RecipeDB, ApplicationReport
+from ...classes.models import Recipe as RecipeDB, ApplicationReport
 from ...classes.schemas import ApplicationReportSchema
 from ...ext.logger import log
 
@@ -34,16 +32,7 @@ class ApplicationReportResource(Resource):
 
         # validate entities
 
-        user_id = get_jwt_identity()
-
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db, so in prod this wont happen
-            block_user_session_id()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         # Validate args by loading it into schema
 
@@ -4,15 +4,16 @@ from datetime import datetime, timezone
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 
 from .errors import return_error_sql
-from ...classes.functions import block_user_session_id
-from ...classes.models import User as UserDB, ShoppingList as ShoppingListDB, \
+from ...classes.models import ShoppingList as ShoppingListDB, \
     ShoppingIngredient as ShoppingIngredientDB, Ingredient as IngredientDB, USER_TYPE, Notification as NotificationDB
-from ...classes.schemas import ShoppingListSchema, build_metadata, ShoppingListPatchSchema, NotificationSchema
+from ...classes.pagination import keyset_paginate, keyset_order, InvalidCursor, offset_paginate
+from ...classes.schemas import ShoppingListSchema, build_page_metadata, ShoppingListPatchSchema, NotificationSchema, \
+    build_cursor_metadata
 from ...ext.logger import log
 
 api = Namespace("calendar", description="Here are all comment endpoints")
@@ -20,7 +21,10 @@ api = Namespace("calendar", description="Here are all comment endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument("id", type=int, help="ID of the calendar to delete")
+parser.add_argument('cursor', type=str, help='Opaque cursor for keyset pagination, empty for the first page.')
 
 ENDPOINT = "/notification"
 
@@ -34,28 +38,30 @@ class NotificationResource(Resource):
         """
         log.info("Entering GET /notification endpoint")
         args = parser.parse_args()
-        user_id = get_jwt_identity()
         page = args['page'] if args['page'] else 1
         page_size = args['page_size'] if args['page_size'] else 5
+        cursor = args['cursor']
 
-        try:
-            user = UserDB.get(UserDB.id == user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found.")
-            return Response(status=400, response="User couldn't be found.")
+        user = current_user
 
         response_holder = {}
 
-        query = NotificationDB.select().where((NotificationDB.user == user)).order_by(
-            NotificationDB.created_date.desc())
-        total_shopping_lists = int(query.count())
-        total_pages = math.ceil(total_shopping_lists / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_shopping_lists, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        sort_keys = [(NotificationDB.created_date, True), (NotificationDB.id, True)]
+
+        query = NotificationDB.select().where((NotificationDB.user == user)).order_by(*keyset_order(sort_keys))
+
+        if cursor is not None:
+            try:
+                page_query, next_cursor = keyset_paginate(query, sort_keys, cursor, page_size)
+            except InvalidCursor as e:
+                return Response(status=400, response=str(e))
+            response_holder["_metadata"] = build_cursor_metadata(page_size, next_cursor, ENDPOINT)
+        else:
+            page_query, total_shopping_lists, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_shopping_lists, has_next, ENDPOINT)
 
         response_holder["result"] = []
-        for notification in query.paginate(page, page_size):
+        for notification in page_query:
             response_holder["result"].append(NotificationSchema().dump(notification))
 
         log.info("Exiting GET /notification endpoint")
@@ -73,7 +79,6 @@ class NotificationResource(Resource):
         """
         log.info("Entering GET /notification endpoint")
         args = parser.parse_args()
-        user_id = get_jwt_identity()
 
         # gets recipe id
         notification_id = args["id"]
@@ -81,12 +86,7 @@ class NotificationResource(Resource):
         if not notification_id:
             return Response(status=400, response="Invalid arguments...")
 
-        try:
-            user = UserDB.get(UserDB.id == user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found.")
-            return Response(status=400, response="User couldn't be found.")
+        user = current_user
 
         try:
             query = NotificationDB.get((NotificationDB.user == user) & (NotificationDB.id == notification_id))
@@ -104,19 +104,13 @@ class NotificationResource(Resource):
         Update user's notifications.
         """
         log.info("PUT /notification")
-        user_id = get_jwt_identity()
         args = parser.parse_args()
         id = args['id'] if args['id'] else None
 
         if not id:
             return Response(status=400, response="Id must be supplied.")
 
-        try:
-            user_query = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response=f'User couldnt be found by this id: {user_id}.')
+        user_query = current_user
 
         try:
             notification = NotificationDB.get(
@@ -146,14 +140,8 @@ class NotificationResource(Resource):
         """
         log.info("DELETE /notification")
         args = parser.parse_args()
-        user_id = get_jwt_identity()
 
-        try:
-            user_model = UserDB.get(UserDB.id == user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="Client couldn't be found.")
+        user_model = current_user
 
         if not args["id"]:
             log.error("Invalid arguments: 'id' is missing.")
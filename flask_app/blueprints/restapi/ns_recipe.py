@@ -1,19 +1,29 @@
 import json
 import math
+import random
 from datetime import timezone
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 
-from ...classes.functions import normalize_quantity, block_user_session_id
+from ...classes.hydration import hydrate_recipes, load_recipes
+from ...classes.pagination import keyset_paginate, keyset_order, InvalidCursor, seed_start, rotated_page, \
+    rotated_paginate, offset_paginate, cached_count
+from ...classes.lookups import tag_lookup, ingredient_lookup
+from ...classes.ingestion import prepare_recipe, write_recipes, InvalidRecipe, normalize_ingredients, ingredient_rows, \
+    BULK_CHUNK_SIZE, BULK_MAX_ITEMS
+from ...classes.search import index_recipe, index_recipes, document_match, tags_match, has_search_terms
 from ...classes.models import Recipe as RecipeDB, \
     RecipeTagThrough as RecipeTagThroughDB, Tag as TagDB, User as UserDB, RecipeBackground as RecipeBackgroundDB, \
-    NutritionInformation as NutritionInformationDB
+    NutritionInformation as NutritionInformationDB, RecipeSearchDocument as RecipeSearchDocumentDB, db, \
+    RANDOM_RANK_RANGE
 from ...classes.schemas import *
+from ...ext.cache import response_cache, recipe_tag, user_tag, recipe_list_tag, RECIPE_LISTS
 from ...ext.logger import log
+from ...ext.views import view_counter
 
 # Create name space
 api = Namespace("Recipes", description="Here are all Recipes endpoints")
@@ -23,12 +33,19 @@ api = Namespace("Recipes", description="Here are all Recipes endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument('id', type=int, help='The recipe id to be search.')
 parser.add_argument('searchString', type=str, help='The string to be search.')
 parser.add_argument('searchTag', type=str, help='The tag to be search.')
+parser.add_argument('string', type=str, help='The string to be search.')
 parser.add_argument('user_id', type=int, help='The user id to be search.')
 parser.add_argument('commented_by', type=int, help='The user id to be search.')
 parser.add_argument('by', type=str, help='Type of background sort type.')
+parser.add_argument('cursor', type=str, help='Opaque cursor for keyset pagination, empty for the first page.')
+parser.add_argument('seed', type=str, help='Seed of the RANDOM sort, the same seed returns the same order.')
+parser.add_argument('view', type=str, help='card or full (default), the recipe fields sent.')
+parser.add_argument('fields', type=str, help='Comma separated recipe fields to send, overrides view.')
 
 ENDPOINT = "/recipe"
 
@@ -46,6 +63,33 @@ class RECIPES_SORTING_TYPE(Enum):
 
 RECIPES_SORTING_TYPE_SET = RECIPES_SORTING_TYPE._value2member_map_
 
+# response cache tags
+
+def recipe_cache_tags(recipe):
+    tags = {recipe_tag(recipe["id"])}
+    if "created_by" in recipe:
+        tags.add(user_tag(recipe["created_by"]["id"]))
+    return tags
+
+
+def recipe_list_cache_tags(payload):
+    args = request.args
+    tags = {RECIPE_LISTS, recipe_list_tag(args.get('by') or RECIPES_SORTING_TYPE.DATE.value)}
+
+    if args.get('searchString') or args.get('searchTag'):
+        tags.add(recipe_list_tag("SEARCH"))
+    if args.get('commented_by'):
+        tags.add(recipe_list_tag(f"commented_by:{args.get('commented_by')}"))
+
+    for recipe in payload["result"]:
+        tags |= recipe_cache_tags(recipe)
+    return tags
+
+
+def unseeded_random():
+    # each one gets its own random seed, a cached response would give every client the same order
+    return request.args.get('by') == RECIPES_SORTING_TYPE.RANDOM.value and not request.args.get('seed')
+
 
 # Create resources
 @api.route("/list")
@@ -53,6 +97,7 @@ RECIPES_SORTING_TYPE_SET = RECIPES_SORTING_TYPE._value2member_map_
 class RecipeListResource(Resource):
 
     @api.expect(parser)
+    @response_cache.cached(recipe_list_cache_tags, skip=unseeded_random)
     def get(self):
         """List recipes by string search and all"""
         # logging
@@ -65,17 +110,25 @@ class RecipeListResource(Resource):
         page_size = args['page_size'] if args['page_size'] else 5
         by = str(args['by']) if args['by'] and args['by'] in RECIPES_SORTING_TYPE_SET else None
         user_id = args['user_id'] if args['user_id'] and args['user_id'] != -1 else None
+        cursor = args['cursor']
 
         # validate args
 
         if page <= 0:
             return Response(status=400, response="page cant be negative")
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
 
-        # query building
+        # query building, only the ids of a page are read from the sort index, its recipes are loaded after
 
         # Pesquisa por String
 
@@ -87,7 +140,7 @@ class RecipeListResource(Resource):
             except peewee.DoesNotExist:
                 return Response(status=400, response="There is no user whit that id.")
 
-            query = RecipeDB.select().where(RecipeDB.created_by == user)
+            query = RecipeDB.select(RecipeDB.id).where(RecipeDB.created_by == user)
         elif args['commented_by']:
 
             # validate if client profile is public
@@ -96,29 +149,44 @@ class RecipeListResource(Resource):
             except peewee.DoesNotExist:
                 return Response(status=400, response="There is no user whit that id.")
 
-            query = (Recipe
-                     .select()
-                     .distinct()
-                     .join(Comment)
-                     .join(User)
-                     .where(Comment.user == args['commented_by']))
+            # IN (subquery) instead of a join, so the ids don't need a DISTINCT over the sort columns
+            query = (RecipeDB
+                     .select(RecipeDB.id)
+                     .where(RecipeDB.id.in_(Comment.select(Comment.recipe).where(Comment.user == user))))
 
         else:
             # pesquisa normal
-            query = RecipeDB.select()
+            query = RecipeDB.select(RecipeDB.id)
 
-        if args['searchString']:
-            query = (query
-                     .where((RecipeDB.title.contains(args['searchString'])) | (RecipeDB.id == args['searchString'])))
+        # default order, (key, descending) pairs ending in a unique column so they can seed a cursor
+        sort_keys = [(RecipeDB.created_date, False), (RecipeDB.id, False)]
+        sort_scope = by
+        seed = None
 
-        if args['searchTag']:
+        # full text search over the recipe search documents
+
+        search_string = args['searchString'] if args['searchString'] and has_search_terms(args['searchString']) else None
+        search_tag = args['searchTag'] if args['searchTag'] and has_search_terms(args['searchTag']) else None
+
+        if search_string and search_string.isdigit():
+            query = query.where(RecipeDB.id == int(search_string))
+            search_string = None
+
+        if search_string or search_tag:
             query = (query
-                     .switch(Recipe)
-                     .join(RecipeTagThroughDB).join(TagDB)
-                     .where(TagDB.title.contains(args['searchTag'])))
+                     .switch(RecipeDB)
+                     .join(RecipeSearchDocumentDB, on=(RecipeSearchDocumentDB.recipe == RecipeDB.id)))
+
+        if search_string:
+            relevance = document_match(search_string)
+            query = query.where(relevance)
+
+            # most relevant first, unless another sort is asked for
+            sort_keys = [(relevance, True), (RecipeDB.id, True)]
+            sort_scope = "RELEVANCE"
 
-        # apply default order_by
-        query.order_by(RecipeDB.created_date.asc())
+        if search_tag:
+            query = query.where(tags_match(search_tag))
 
         # Check if sorted
 
@@ -126,11 +194,16 @@ class RecipeListResource(Resource):
 
             if by == RECIPES_SORTING_TYPE.DATE.value:
 
-                query = query.order_by(RecipeDB.created_date)
+                sort_keys = [(RecipeDB.created_date, False), (RecipeDB.id, False)]
+                sort_scope = by
 
             elif by == RECIPES_SORTING_TYPE.RANDOM.value:
 
-                query = query.order_by(peewee.fn.Rand())
+                # a seed picks where the precomputed random_rank order starts, so its pages don't overlap
+                seed = args['seed'] if args['seed'] else str(random.getrandbits(32))
+                sort_keys = None
+                sort_scope = f"{by}:{seed}"
+                query = query.select_extend(RecipeDB.random_rank)
             elif by == RECIPES_SORTING_TYPE.VERIFIED.value:
 
                 query = (query
@@ -138,45 +211,60 @@ class RecipeListResource(Resource):
 
             elif by == RECIPES_SORTING_TYPE.LIKES.value:
 
-                likes_subquery = (RecipeBackground
-                                  .select(peewee.fn.COUNT(RecipeBackground.id))
-                                  .where((RecipeBackground.recipe == RecipeDB.id) &
-                                         (RecipeBackground.type == RECIPES_BACKGROUND_TYPE.LIKED.value))
-                                  .alias('likes'))
-
-                query = (query
-                         .select(RecipeDB, likes_subquery)
-                         .order_by(peewee.SQL('likes').desc()))
+                sort_keys = [(RecipeDB.likes_count, True), (RecipeDB.id, True)]
+                sort_scope = by
 
             elif by == RECIPES_SORTING_TYPE.SAVES.value:
 
-                likes_subquery = (RecipeBackground
-                                  .select(peewee.fn.COUNT(RecipeBackground.id))
-                                  .where((RecipeBackground.recipe == RecipeDB.id) &
-                                         (RecipeBackground.type == RECIPES_BACKGROUND_TYPE.SAVED.value))
-                                  .alias('saves'))
-
-                query = (query
-                         .select(RecipeDB, likes_subquery)
-                         .order_by(peewee.SQL('saves').desc()))
+                sort_keys = [(RecipeDB.saves_count, True), (RecipeDB.id, True)]
+                sort_scope = by
 
             elif by == RECIPES_SORTING_TYPE.CLASSIFICATION.value:
-                query = query.select(Recipe, fn.AVG(RecipeRating.rating).alias('avg_rating')) \
-                    .join(RecipeRating, JOIN.LEFT_OUTER, on=(Recipe.id == RecipeRating.recipe)) \
-                    .group_by(Recipe.id) \
-                    .order_by(fn.AVG(RecipeRating.rating).desc())
-        # metadata
 
-        total_recipes = int(query.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["_metadata"] = metadata
+                sort_keys = [(RecipeDB.rating_average, True), (RecipeDB.id, True)]
+                sort_scope = by
+
+        if sort_keys:
+            query = query.order_by(*keyset_order(sort_keys))
+
+        if cursor is not None:
+
+            # keyset pagination
+
+            try:
+                if seed is not None:
+                    page_query, next_cursor = rotated_paginate(query, RecipeDB.random_rank, RecipeDB.id,
+                                                               seed_start(seed, RANDOM_RANK_RANGE), cursor,
+                                                               page_size, scope=sort_scope)
+                else:
+                    page_query, next_cursor = keyset_paginate(query, sort_keys, cursor, page_size, scope=sort_scope)
+            except InvalidCursor as e:
+                return Response(status=400, response=str(e))
+
+            response_holder["_metadata"] = build_cursor_metadata(page_size, next_cursor, ENDPOINT)
+
+        else:
+
+            # metadata
+
+            if seed is not None:
+                rows = rotated_page(query, RecipeDB.random_rank, RecipeDB.id, seed_start(seed, RANDOM_RANK_RANGE),
+                                    (page - 1) * page_size, page_size + 1)
+                page_query, has_next = rows[:page_size], len(rows) > page_size
+                total_recipes = cached_count(query) if args['include_total'] else None
+            else:
+                page_query, total_recipes, has_next = offset_paginate(query, page, page_size, args['include_total'])
+
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
+
+        if seed is not None:
+            response_holder["_metadata"]["seed"] = seed
 
         # response data
 
         recipes = []
-        for recipe in query.paginate(page, page_size):
-            recipe_schema = RecipeSchema().dump(recipe)
+        for recipe in hydrate_recipes(load_recipes(page_query, columns), relations):
+            recipe_schema = schema.dump(recipe)
             recipes.append(recipe_schema)
 
         response_holder["result"] = recipes
@@ -187,6 +275,9 @@ class RecipeListResource(Resource):
 @api.route("")
 class RecipeResource(Resource):
 
+    # counted outside of the cache, so cache hits and 304s are views too
+    @view_counter.counted("id")
+    @response_cache.cached(recipe_cache_tags)
     def get(self):
         """ Get a recipe with ID """
 
@@ -202,18 +293,21 @@ class RecipeResource(Resource):
         if not args["id"]:
             return Response(status=400, response="Invalid arguments...")
 
-        # Get and Serialize db model
-
         try:
-            recipe_record = RecipeDB.get(id=args["id"])
-            ## add likes to recipe model
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
 
-            recipe_schema = RecipeSchema().dump(recipe_record)
+        # Get and Serialize db model
 
-        except peewee.DoesNotExist:
+        recipe_records = hydrate_recipes(RecipeDB.select(*columns).where(RecipeDB.id == args["id"]), relations)
+
+        if not recipe_records:
             log.error("Recipe does not exist...")
             return Response(status=400, response="Recipe does not exist...")
 
+        recipe_schema = schema.dump(recipe_records[0])
+
         log.info("Finished GET /recipe")
         return Response(status=200, response=json.dumps(recipe_schema), mimetype="application/json")
 
@@ -225,10 +319,6 @@ class RecipeResource(Resource):
 
         json_data = request.get_json()
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Validate args by loading it into schema
 
         try:
@@ -239,103 +329,82 @@ class RecipeResource(Resource):
 
         # Verify existence of the requested ids model's
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # should not reach prod (seria muito mau sinal se for preciso)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User does not exist...")
-            return Response(status=400, response="Client couln't be found by this id.")
+        user = current_user
 
         # Change get or create needed objects
         # removing because the must be transformed before entity building
-        nutrition_table = recipe_validated.pop('nutrition_information')
+        nutrition_table = recipe_validated.pop('nutrition_information', None)
         preparation = recipe_validated.pop('preparation')
         ingredients = recipe_validated.pop('ingredients')
-        tags = recipe_validated.pop('tags')
+        tags = recipe_validated.pop('tags', None)
+
+        # tags and ingredients are resolved before the transaction, see NameLookup.ids
+
+        try:
+            tag_ids = list(tag_lookup.ids([t['title'] for t in tags or []]).values())
+        except Exception as e:
+            log.error("Tags Table has some error...")
+            return Response(status=400, response="Tags Table has some error.\n" + str(e))
+
+        try:
+            ingredient_quantities = normalize_ingredients(ingredients or [])
+            ingredient_ids = ingredient_lookup.ids([item['name'] for item in ingredient_quantities])
+        except Exception as e:
+            log.error("Ingredients Table has some error...")
+            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
         # fills recipe object
         recipe = RecipeDB(**recipe_validated)
-        recipe.preparation = pickle.dumps(preparation)
-        # use .decode() to decode
+        recipe.preparation = preparation
 
         # set created by user
         recipe.created_by = user
 
-        # build relation to nutrition_table
+        # one transaction for the whole recipe, with a savepoint per section,
+        # so an error leaves nothing behind and readers never see half a recipe
 
-        try:
-            if nutrition_table and nutrition_table != {}:
-                nutrition_information = NutritionInformationDB(**nutrition_table)
-                nutrition_information.save()
-                recipe.nutrition_information = nutrition_information
+        with db.atomic() as transaction:
 
-        except Exception as e:
-            recipe.delete_instance(recursive=True)
-            log.error("Nutrition Table has some error...")
-            return Response(status=400, response="Nutrition Table has some error.\n" + str(e))
-
-        ## recipe needs to be saved after foreign key's but before multiple to multiple relations
-        # because to build these last one recipe needs to already have an id, wich is done by save()
-        recipe.save()
-
-        # build multi to multi relation to tags
+            # build relation to nutrition_table
 
-        try:
-            if tags and tags != {}:
-                for t in tags:
-                    tag, created = TagDB.get_or_create(title=t)
-                    tag.save()
-                    recipe.tags.add(tag)
+            try:
+                with db.atomic():
+                    if nutrition_table and nutrition_table != {}:
+                        recipe.nutrition_information = NutritionInformationDB.create(**nutrition_table)
+            except Exception as e:
+                transaction.rollback()
+                log.error("Nutrition Table has some error...")
+                return Response(status=400, response="Nutrition Table has some error.\n" + str(e))
 
+            ## recipe needs to be saved after foreign key's but before multiple to multiple relations
+            # because to build these last one recipe needs to already have an id, wich is done by save()
+            recipe.save()
 
-        except Exception as e:
-            recipe.delete_instance(recursive=True)
-            log.error("Tags Table has some error...")
-            return Response(status=400, response="Tags Table has some error.\n" + str(e))
+            # build multi to multi relation to tags
 
-        # build multi to multi relation to Ingredient Quantity
-        try:
-            if ingredients and ingredients != {}:
-                for i in ingredients:
-                    ingredient, created = Ingredient.get_or_create(name=i['ingredient']['name'])
-                    quantity_normalized = float(0)
-                    units_normalized = UNITS_TYPE.GRAMS.value
-                    extra_quantity_normalized = None
-                    extra_units = None
-                    if created:
-                        ingredient.save()
-                    if i['quantity_original']:
-                        try:
-                            units_normalized, quantity_normalized, extra_quantity_normalized, extra_units = normalize_quantity(
-                                i['quantity_original'])
-                        except Exception as e:
-                            recipe.delete_instance(recursive=True)
-                            log.error("Tags Table has some error...")
-                            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
-
-                    ingredient_quantity = RecipeIngredientQuantity(quantity_original=i['quantity_original'],
-                                                                   quantity_normalized=quantity_normalized,
-                                                                   units_normalized=units_normalized,
-                                                                   extra_quantity_normalized=extra_quantity_normalized,
-                                                                   extra_units=extra_units)
-                    ingredient_quantity.ingredient = ingredient
-                    ingredient_quantity.recipe = recipe
-                    ingredient_quantity.save()
+            try:
+                with db.atomic():
+                    if tag_ids:
+                        recipe.tags.add(tag_ids)
+            except Exception as e:
+                transaction.rollback()
+                log.error("Tags Table has some error...")
+                return Response(status=400, response="Tags Table has some error.\n" + str(e))
 
-        except Exception as e:
-            recipe.delete_instance(recursive=True)
-            log.error("Ingredients Table has some error...")
-            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
+            # build multi to multi relation to Ingredient Quantity
 
-        # finally build full object
+            try:
+                with db.atomic():
+                    if ingredient_quantities:
+                        RecipeIngredientQuantity.insert_many(
+                            ingredient_rows(recipe.id, ingredient_quantities, ingredient_ids)).execute()
+            except Exception as e:
+                transaction.rollback()
+                log.error("Ingredients Table has some error...")
+                return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
-        recipe.save()
+        index_recipe(recipe.id)
+        response_cache.invalidate(RECIPE_LISTS)
 
         return Response(status=201)
 
@@ -347,16 +416,7 @@ class RecipeResource(Resource):
         log.info("DELETE /recipe")
 
         # gets user auth id
-        user_id = get_jwt_identity()
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User does not exist...")
-            return Response(status=400, response="Client couldn't be found by this id.")
+        user = current_user
 
         # Get args
         args = parser.parse_args()
@@ -377,11 +437,18 @@ class RecipeResource(Resource):
             return Response(status=400, response="Recipe does not exist...")
 
         try:
-            recipe.delete_instance(recursive=True)
+            # the recipe, its dependents and its nutrition table go together or not at all
+            with db.atomic():
+                recipe.delete_instance(recursive=True)
+                if recipe.nutrition_information_id:
+                    NutritionInformationDB.delete().where(
+                        NutritionInformationDB.id == recipe.nutrition_information_id).execute()
         except Exception as e:
             log.error("Recipe could not be deleted...")
             return Response(status=400, response="Recipe could not be deleted.\n" + str(e))
 
+        response_cache.invalidate(recipe_tag(recipe_id), RECIPE_LISTS)
+
         log.info("Finished DELETE /recipe")
         return Response(status=200, response="Recipe was successfully deleted.")
 
@@ -420,62 +487,90 @@ class RecipeResource(Resource):
             return Response(status=400, response="Recipe couldn't be found by this id.")
 
         # gets user auth id
-        user_id = get_jwt_identity()
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User does not exist...")
-            return Response(status=400, response="Client couldn't be found by this id.")
-
-        try:
-            recipe.title = recipe_validated['title']
-            recipe.description = recipe_validated['description']
-            recipe.preparation = recipe_validated['preparation']
-            recipe.ingredients = recipe_validated['ingredients']
-            recipe.portion = recipe_validated['portion']
-
-            # Change get or create needed objects
-            # removing because the must be transformed before entity building
-            nutrition_table = recipe_validated.pop('nutrition_informations')
-            preparation = recipe_validated.pop('preparation')
-            ingredients = recipe_validated.pop('ingredients')
-            tags = recipe_validated.pop('tags')
-
-            # fills recipe object
-            recipe.preparation = str(preparation).encode()
-            recipe.ingredients = str(ingredients).encode()
-            # use .decode() to decode
+        user = current_user
 
-            # build multi to multi relation to tags
-            try:
-                rows_deleted = TagDB.recipes.get_through_model().delete().where(
-                    TagDB.recipes.get_through_model().recipe_id == recipe.get_id()).execute()
+        # Change get or create needed objects
+        # removing because the must be transformed before entity building
+        nutrition_table = recipe_validated.pop('nutrition_information', None)
+        preparation = recipe_validated.pop('preparation')
+        ingredients = recipe_validated.pop('ingredients')
+        tags = recipe_validated.pop('tags', None)
 
-                if tags and tags != {} and rows_deleted:
-                    for t in tags:
-                        tag, created = TagDB.get_or_create(title=t)
-                        recipe.tags.add(tag)
-                        tag.save()
+        # tags and ingredients are resolved before the transaction, see NameLookup.ids
 
-            except Exception as e:
-                log.error("Tags Table has some error...")
-                return Response(status=400, response="Tags Table has some error.\n" + str(e))
+        try:
+            tag_ids = list(tag_lookup.ids([t['title'] for t in tags or []]).values())
+        except Exception as e:
+            log.error("Tags Table has some error...")
+            return Response(status=400, response="Tags Table has some error.\n" + str(e))
 
-            try:
-                if nutrition_table and nutrition_table != {}:
-                    NutritionInformationDB.update(**nutrition_table).where(
-                        NutritionInformationDB.recipe == recipe)
-            except Exception as e:
-                log.error("Nutrition Table has some error...")
-                return Response(status=400, response="Nutrition Table has some error.\n" + str(e))
+        try:
+            ingredient_quantities = normalize_ingredients(ingredients or [])
+            ingredient_ids = ingredient_lookup.ids([item['name'] for item in ingredient_quantities])
+        except Exception as e:
+            log.error("Ingredients Table has some error...")
+            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
-            # finally build full object
+        try:
+            recipe.title = recipe_validated['title']
+            recipe.description = recipe_validated['description']
+            recipe.preparation = preparation
+            if 'portion' in recipe_validated:
+                recipe.portion = recipe_validated['portion']
+
+            # one transaction for the whole update, with a savepoint per section
+
+            with db.atomic() as transaction:
+
+                # replace the tags
+
+                try:
+                    with db.atomic():
+                        RecipeTagThroughDB.delete().where(RecipeTagThroughDB.recipe == recipe).execute()
+                        if tag_ids:
+                            recipe.tags.add(tag_ids)
+                except Exception as e:
+                    transaction.rollback()
+                    log.error("Tags Table has some error...")
+                    return Response(status=400, response="Tags Table has some error.\n" + str(e))
+
+                # replace the ingredients
+
+                try:
+                    with db.atomic():
+                        RecipeIngredientQuantity.delete().where(RecipeIngredientQuantity.recipe == recipe).execute()
+                        if ingredient_quantities:
+                            RecipeIngredientQuantity.insert_many(
+                                ingredient_rows(recipe.id, ingredient_quantities, ingredient_ids)).execute()
+                except Exception as e:
+                    transaction.rollback()
+                    log.error("Ingredients Table has some error...")
+                    return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
+
+                # update the nutrition table, or create it when the recipe had none
+
+                try:
+                    with db.atomic():
+                        if nutrition_table and nutrition_table != {}:
+                            if recipe.nutrition_information_id:
+                                (NutritionInformationDB
+                                 .update(**nutrition_table)
+                                 .where(NutritionInformationDB.id == recipe.nutrition_information_id)
+                                 .execute())
+                            else:
+                                recipe.nutrition_information = NutritionInformationDB.create(**nutrition_table)
+                except Exception as e:
+                    transaction.rollback()
+                    log.error("Nutrition Table has some error...")
+                    return Response(status=400, response="Nutrition Table has some error.\n" + str(e))
+
+                # finally build full object
+
+                recipe.save()
+
+            index_recipe(recipe.id)
+            response_cache.invalidate(recipe_tag(recipe.id), recipe_list_tag("SEARCH"))
 
-            recipe.save()
             log.info("Finished PUT /recipe")
             return Response(status=200, response="Recipe was successfully updated")
         except Exception as e:
@@ -503,7 +598,7 @@ class RecipeListBackgroundSortResource(Resource):
 
         page = int(args['page']) if args['page'] else 1
         page_size = int(args['page_size']) if args['page_size'] else 5
-        by = f"'{str(args['by'])}'" if args['by'] and args['by'] in RECIPES_BACKGROUND_TYPE_SET else None
+        by = str(args['by']) if args['by'] and args['by'] in RECIPES_BACKGROUND_TYPE_SET else None
 
         # validate args
 
@@ -514,48 +609,50 @@ class RecipeListBackgroundSortResource(Resource):
         if page_size not in [5, 10, 20, 40]:
             return Response(status=400, response="page_size not in [5, 10, 20, 40]")
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
 
-        # query building
+        # query building, the ranking only reads (counter, id) from the counter index
+
+        if by == RECIPES_BACKGROUND_TYPE.LIKED.value:
+            counter = RecipeDB.likes_count
+        else:
+            counter = RecipeDB.saves_count
 
         # Pesquisa por String
         if args['string']:
             query = (RecipeDB
-                     .select(RecipeDB, peewee.fn.COUNT(peewee.Case(RecipeBackground.type, [(peewee.SQL(by), 1)]))
-                             .alias('like_count'))
+                     .select(RecipeDB.id, counter)
                      .distinct()
-                     .join(RecipeBackground, peewee.JOIN.LEFT_OUTER)
-                     .switch(RecipeDB)
                      .join(RecipeTagThroughDB).join(TagDB)
                      .where(TagDB.title.contains(args['string']) | RecipeDB.title.contains(args['string']))
-                     .group_by(RecipeDB.id, RecipeDB.title)
-                     .order_by(peewee.SQL('like_count').desc()))
+                     .order_by(counter.desc(), RecipeDB.id.desc()))
 
 
         else:
 
             query = (RecipeDB
-                     .select(RecipeDB, peewee.fn.COUNT(peewee.Case(RecipeBackground.type, [(peewee.SQL(by), 1)]))
-                             .alias('like_count'))
-                     .distinct()
-                     .join(RecipeBackground, peewee.JOIN.LEFT_OUTER)
-                     .group_by(RecipeDB.id, RecipeDB.title)
-                     .order_by(peewee.SQL('like_count').desc()))
+                     .select(RecipeDB.id, counter)
+                     .order_by(counter.desc(), RecipeDB.id.desc()))
 
         # metadata
 
-        total_recipes = int(query.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response data
 
         recipes = []
-        for recipe in query.paginate(page, page_size):
-            recipe_schema = RecipeSchema().dump(recipe)
+        for recipe in hydrate_recipes(load_recipes(page_query, columns), relations):
+            recipe_schema = schema.dump(recipe)
             recipes.append(recipe_schema)
 
         response_holder["result"] = recipes
@@ -578,9 +675,6 @@ class RecipeRatingResource(Resource):
         # logging
         log.info("POST /rating")
 
-        # gets user auth id
-        user_id = get_jwt_identity()
-
         # Get args
         args = parser.parse_args()
 
@@ -607,24 +701,25 @@ class RecipeRatingResource(Resource):
             log.error("Recipe to be liked, couln't be found.")
             return Response(status=400, response="Recipe to be liked, couln't be found.")
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
+
+        with db.atomic():
+            recipe_rating, created = RecipeRating \
+                .get_or_create(user=user, recipe=recipe_to_be_rated)
+
+            previous_rating = recipe_rating.rating or 0
+            recipe_rating.rating = body["rate"]
+
+            recipe_rating.save()
 
-        recipe_rating, created = RecipeRating \
-            .get_or_create(user=user, recipe=recipe_to_be_rated)
+            RecipeDB.update_counters(recipe_to_be_rated.id, rating_count=1 if created else 0,
+                                     rating_sum=body["rate"] - previous_rating)
 
-        recipe_rating.rating = body["rate"]
+        response_cache.invalidate(recipe_tag(recipe_to_be_rated.id),
+                                  recipe_list_tag(RECIPES_SORTING_TYPE.CLASSIFICATION.value))
 
-        recipe_rating.save()
+        # reload the counters that were just updated
+        recipe_to_be_rated = RecipeDB.get_by_id(recipe_to_be_rated.id)
 
         log.info("Finished POST /like")
         return Response(status=201,response=json.dumps(RecipeSchema().dump(recipe_to_be_rated)))
@@ -649,12 +744,18 @@ class RecipeRatingResource(Resource):
             return Response(status=400, response="Missing arguments...")
 
         # query
-        query = RecipeRating.delete() \
-            .where((RecipeRating.user == user_id) & (RecipeRating.recipe == args["id"])).execute()
+        with db.atomic():
+            try:
+                recipe_rating = RecipeRating.get((RecipeRating.user == user_id) & (RecipeRating.recipe == args["id"]))
+            except peewee.DoesNotExist:
+                log.error("User did not rate this recipe.")
+                return Response(status=400, response="User did not rate this recipe.")
 
-        if query != 1:
-            log.error("User did not rate this recipe.")
-            return Response(status=400, response="User did not rate this recipe.")
+            recipe_rating.delete_instance()
+
+            RecipeDB.update_counters(args["id"], rating_count=-1, rating_sum=-(recipe_rating.rating or 0))
+
+        response_cache.invalidate(recipe_tag(args["id"]), recipe_list_tag(RECIPES_SORTING_TYPE.CLASSIFICATION.value))
 
         log.info("Finished DELETE /like")
         return Response(status=204)
@@ -676,10 +777,6 @@ class RecipeLikeResource(Resource):
         # logging
         log.info("POST /like")
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Get args
 
         args = parser.parse_args()
@@ -700,30 +797,23 @@ class RecipeLikeResource(Resource):
             log.error("Recipe to be liked, couln't be found.")
             return Response(status=400, response="Recipe to be liked, couln't be found.")
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         # fills comment object
 
         # add like
 
-        recipe_background, created = RecipeBackgroundDB.get_or_create(user=user, recipe=recipe_to_be_liked,
-                                                                      type=RECIPES_BACKGROUND_TYPE.LIKED.value)
+        with db.atomic():
+            recipe_background, created = RecipeBackgroundDB.get_or_create(user=user, recipe=recipe_to_be_liked,
+                                                                          type=RECIPES_BACKGROUND_TYPE.LIKED.value)
+            if created:
+                RecipeDB.update_counters(recipe_to_be_liked.id, likes_count=1)
 
         if not created:
             log.error("User already liked this recipe.")
             return Response(status=400, response="User already liked this recipe.")
 
-        recipe_background.save()
+        response_cache.invalidate(recipe_tag(recipe_to_be_liked.id), recipe_list_tag(RECIPES_SORTING_TYPE.LIKES.value))
 
         log.info("Finished POST /like")
         return Response(status=201)
@@ -753,15 +843,21 @@ class RecipeLikeResource(Resource):
 
         # query
 
-        query = RecipeBackgroundDB.delete() \
-            .where(
-            ((RecipeBackgroundDB.recipe == like_to_be_deleted_id) & (RecipeBackgroundDB.user == user_id)) & (
-                    RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.LIKED.value)).execute()
+        with db.atomic():
+            query = RecipeBackgroundDB.delete() \
+                .where(
+                ((RecipeBackgroundDB.recipe == like_to_be_deleted_id) & (RecipeBackgroundDB.user == user_id)) & (
+                        RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.LIKED.value)).execute()
+
+            if query:
+                RecipeDB.update_counters(like_to_be_deleted_id, likes_count=-query)
 
         if query != 1:
             log.error("User does not like this recipe.")
             return Response(status=400, response="User does not like this recipe.")
 
+        response_cache.invalidate(recipe_tag(like_to_be_deleted_id), recipe_list_tag(RECIPES_SORTING_TYPE.LIKES.value))
+
         log.info("Finished DELETE /like")
         return Response(status=204)
 
@@ -796,6 +892,13 @@ class RecipeLikesResource(Resource):
 
         user_id = get_jwt_identity()
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
@@ -803,21 +906,19 @@ class RecipeLikesResource(Resource):
         # query
         RecipeDB.select(RecipeDB).distinct().join(RecipeTagThroughDB).join(TagDB)
 
-        query = RecipeDB.select(RecipeDB).distinct().join(RecipeBackgroundDB).join(UserDB) \
+        query = RecipeDB.select(*columns).distinct().join(RecipeBackgroundDB).join(UserDB) \
             .where(UserDB.id == user_id, RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.LIKED.value)
 
         # metadata
 
-        total_recipes = int(query.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response data
 
         recipes = []
-        for item in query.paginate(page, page_size):
-            recipes.append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            recipes.append(schema.dump(item))
 
         response_holder["result"] = recipes
 
@@ -855,10 +956,6 @@ class RecipeSaveResource(Resource):
         # logging
         log.info("POST /save")
 
-        # gets user auth id
-
-        user_id = get_jwt_identity()
-
         # Get args
 
         args = parser.parse_args()
@@ -879,28 +976,21 @@ class RecipeSaveResource(Resource):
             log.error("Recipe to be saved, couln't be found.")
             return Response(status=400, response="Recipe to be liked, couln't be found.")
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         # fills comment object
 
-        recipe_background, created = RecipeBackgroundDB.get_or_create(user=user, recipe=recipe_to_be_liked,
-                                                                      type=RECIPES_BACKGROUND_TYPE.SAVED.value)
+        with db.atomic():
+            recipe_background, created = RecipeBackgroundDB.get_or_create(user=user, recipe=recipe_to_be_liked,
+                                                                          type=RECIPES_BACKGROUND_TYPE.SAVED.value)
+            if created:
+                RecipeDB.update_counters(recipe_to_be_liked.id, saves_count=1)
 
         if not created:
             log.error("User already saved this recipe.")
             return Response(status=200, response="User already saved this recipe.")
 
-        recipe_background.save()
+        response_cache.invalidate(recipe_list_tag(RECIPES_SORTING_TYPE.SAVES.value))
 
         log.info("Finished POST /save")
         return Response(status=201)
@@ -930,10 +1020,17 @@ class RecipeSaveResource(Resource):
 
         # query
 
-        RecipeBackgroundDB.delete() \
-            .where(
-            ((RecipeBackgroundDB.recipe == like_to_be_deleted_id) & (RecipeBackgroundDB.user == user_id)) & (
-                    RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.SAVED.value)).execute()
+        with db.atomic():
+            query = RecipeBackgroundDB.delete() \
+                .where(
+                ((RecipeBackgroundDB.recipe == like_to_be_deleted_id) & (RecipeBackgroundDB.user == user_id)) & (
+                        RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.SAVED.value)).execute()
+
+            if query:
+                RecipeDB.update_counters(like_to_be_deleted_id, saves_count=-query)
+
+        if query:
+            response_cache.invalidate(recipe_list_tag(RECIPES_SORTING_TYPE.SAVES.value))
 
         log.info("Finished DELETE /save")
         return Response(status=204)
@@ -969,6 +1066,13 @@ class RecipeSavesResource(Resource):
 
         user_id = get_jwt_identity()
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
@@ -976,21 +1080,19 @@ class RecipeSavesResource(Resource):
         # query
         RecipeDB.select(RecipeDB).distinct().join(RecipeTagThroughDB).join(TagDB)
 
-        query = RecipeDB.select(RecipeDB).distinct().join(RecipeBackgroundDB).join(UserDB) \
+        query = RecipeDB.select(*columns).distinct().join(RecipeBackgroundDB).join(UserDB) \
             .where(UserDB.id == user_id, RecipeBackgroundDB.type == RECIPES_BACKGROUND_TYPE.SAVED.value)
 
         # metadata
 
-        total_recipes = int(query.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response data
 
         recipes = []
-        for item in query.paginate(page, page_size):
-            recipes.append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            recipes.append(schema.dump(item))
 
         response_holder["result"] = recipes
 
@@ -1053,26 +1155,31 @@ class RecipeCreatesResource(Resource):
 
         user_id = get_jwt_identity()
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
 
         # query
 
-        query = RecipeDB.select(RecipeDB).distinct().where(RecipeDB.created_by == user_id)
+        query = RecipeDB.select(*columns).distinct().where(RecipeDB.created_by == user_id)
 
         # metadata
 
-        total_recipes = int(query.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query, page, page_size, args['include_total'])
+        response_holder["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response data
 
         recipes = []
-        for item in query.paginate(page, page_size):
-            recipes.append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            recipes.append(schema.dump(item))
 
         response_holder["result"] = recipes
 
@@ -1118,11 +1225,18 @@ class RecipeCreatesResource(Resource):
             log.error("User does not exist...")
             return Response(status=400, response="Client couln't be found by this id.")
 
+        # fields sent and columns read
+
+        try:
+            schema, columns, relations = recipe_projection(args['view'], args['fields'])
+        except ValueError as e:
+            return Response(status=400, response=str(e))
+
         # declare response holder
 
         response_holder = {}
 
-        base_query = RecipeDB.select(RecipeDB).where(RecipeDB.created_by == user)
+        base_query = RecipeDB.select(*columns).where(RecipeDB.created_by == user)
 
         """ Most Recent """
 
@@ -1132,62 +1246,45 @@ class RecipeCreatesResource(Resource):
         # metadata
         response_holder["RECENT"] = {}
 
-        total_recipes = int(query_recent.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["RECENT"]["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query_recent, page, page_size, args['include_total'])
+        response_holder["RECENT"]["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response holder
         response_holder["RECENT"]["items"] = []
-        for item in query_recent.paginate(page, page_size):
-            response_holder["RECENT"]["items"].append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            response_holder["RECENT"]["items"].append(schema.dump(item))
 
         """ Most Liked"""
 
         # query
-        likes_subquery = (RecipeBackground
-                          .select(peewee.fn.COUNT(RecipeBackground.id))
-                          .where((RecipeBackground.recipe == RecipeDB.id) &
-                                 (RecipeBackground.type == RECIPES_BACKGROUND_TYPE.LIKED.value))
-                          .alias('likes'))
-
-        query_liked = (base_query
-                       .select(RecipeDB, likes_subquery)
-                       .order_by(peewee.SQL('likes').desc()))
+        query_liked = base_query.order_by(RecipeDB.likes_count.desc(), RecipeDB.id.desc())
 
         # metadata
         response_holder["LIKED"] = {}
 
-        total_recipes = int(query_liked.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["LIKED"]["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query_liked, page, page_size, args['include_total'])
+        response_holder["LIKED"]["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response holder
         response_holder["LIKED"]["items"] = []
-        for item in query_liked.paginate(page, page_size):
-            response_holder["LIKED"]["items"].append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            response_holder["LIKED"]["items"].append(schema.dump(item))
 
         """ Most Rated """
 
         # query
-        query_rated = (base_query.select(Recipe, fn.AVG(RecipeRating.rating).alias('avg_rating'))
-                       .join(RecipeRating, JOIN.LEFT_OUTER, on=(Recipe.id == RecipeRating.recipe))
-                       .group_by(Recipe.id)
-                       .order_by(fn.AVG(RecipeRating.rating).desc()))
+        query_rated = base_query.order_by(RecipeDB.rating_average.desc(), RecipeDB.id.desc())
 
         # metadata
         response_holder["RATED"] = {}
 
-        total_recipes = int(query_rated.count())
-        total_pages = math.ceil(total_recipes / page_size)
-        metadata = build_metadata(page, page_size, total_pages, total_recipes, ENDPOINT)
-        response_holder["RATED"]["_metadata"] = metadata
+        page_query, total_recipes, has_next = offset_paginate(query_rated, page, page_size, args['include_total'])
+        response_holder["RATED"]["_metadata"] = build_page_metadata(page, page_size, total_recipes, has_next, ENDPOINT)
 
         # response holder
         response_holder["RATED"]["items"] = []
-        for item in query_rated.paginate(page, page_size):
-            response_holder["RATED"]["items"].append(RecipeSchema().dump(item))
+        for item in hydrate_recipes(page_query, relations):
+            response_holder["RATED"]["items"].append(schema.dump(item))
 
         log.info("Finished GET /creates")
         return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
@@ -1211,23 +1308,14 @@ class RecipeListResource(Resource):
 
         ## verify user
 
-        user_id = get_jwt_identity()
-
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db, so in prod this wont happen
-            block_user_session_id()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         if user.user_type != USER_TYPE.COMPANY.value:
             return Response(status=403, response="User is not a company.")
 
         # Validate args by loading it into schema
 
-        nutrition_table = json_data.pop('nutrition_information')
+        nutrition_table = json_data.pop('nutrition_information', None)
 
         try:
             recipe_validated = RecipeSchema().load(json_data)
@@ -1239,84 +1327,150 @@ class RecipeListResource(Resource):
         ingredients = recipe_validated.pop('ingredients')
         preparation = recipe_validated.pop('preparation')
 
-        tags = recipe_validated.pop('tags')
+        tags = recipe_validated.pop('tags', None)
+
+        if nutrition_table and 'id' in nutrition_table:
+            nutrition_table.pop('id')
+
+        # tags and ingredients are resolved before the transaction, see NameLookup.ids
+
+        try:
+            tag_ids = list(tag_lookup.ids([t['title'] for t in tags or []]).values())
+        except Exception as e:
+            return Response(status=400, response="Tags Table has some error.\n" + str(e))
+
+        try:
+            ingredient_quantities = normalize_ingredients(ingredients or [])
+            ingredient_ids = ingredient_lookup.ids([item['name'] for item in ingredient_quantities])
+        except Exception as e:
+            log.error("Ingredients Table has some error...")
+            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
         # fills recipe object
         recipe = RecipeDB(**recipe_validated)
-        recipe.preparation = pickle.dumps(preparation)
+        recipe.preparation = preparation
         recipe.created_by = user
 
-        # build relation to nutrition_table
-        if nutrition_table:
-            try:
-                if 'id' in nutrition_table:
-                    nutrition_table.pop('id')
+        # one transaction for the whole recipe, with a savepoint per section
 
-                nutrition_information = NutritionInformationDB(**nutrition_table)
-                nutrition_information.save()
-                recipe.nutrition_information = nutrition_information
+        with db.atomic() as transaction:
+
+            # build relation to nutrition_table
+
+            try:
+                with db.atomic():
+                    if nutrition_table:
+                        recipe.nutrition_information = NutritionInformationDB.create(**nutrition_table)
             except Exception as e:
-                nutrition_information.delete()
-                recipe.delete_instance(recursive=True)
+                transaction.rollback()
                 return Response(status=400, response="Nutrition Table has some error.\n" + str(e))
 
-        recipe.save()
-        ## recipe needs to be saved after foreign key's but before multiple to multiple relations
-        # because to build these last one recipe needs to already have an id, wich is done by save()
+            recipe.save()
+            ## recipe needs to be saved after foreign key's but before multiple to multiple relations
+            # because to build these last one recipe needs to already have an id, wich is done by save()
 
-        # build multi to multi relation to tags
+            # build multi to multi relation to tags
 
-        try:
-            if tags and tags != {}:
-                for t in tags:
-                    tag, created = TagDB.get_or_create(title=t['title'])
-                    tag.save()
-                    recipe.tags.add(tag)
+            try:
+                with db.atomic():
+                    if tag_ids:
+                        recipe.tags.add(tag_ids)
+            except Exception as e:
+                transaction.rollback()
+                return Response(status=400, response="Tags Table has some error.\n" + str(e))
 
+            # build multi to multi relation to Ingredient Quantity
 
-        except Exception as e:
+            try:
+                with db.atomic():
+                    if ingredient_quantities:
+                        RecipeIngredientQuantity.insert_many(
+                            ingredient_rows(recipe.id, ingredient_quantities, ingredient_ids)).execute()
+            except Exception as e:
+                transaction.rollback()
+                log.error("Ingredients Table has some error...")
+                return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
-            recipe.delete_instance(recursive=True)
-            return Response(status=400, response="Tags Table has some error.\n" + str(e))
+        index_recipe(recipe.id)
+        response_cache.invalidate(RECIPE_LISTS)
 
-        # build multi to multi relation to Ingredient Quantity
-        try:
-            if ingredients and ingredients != {}:
-                for i in ingredients:
-                    ingredient, created = Ingredient.get_or_create(name=i['ingredient']['name'])
-                    quantity_normalized = float(0)
-                    units_normalized = UNITS_TYPE.GRAMS.value
-                    extra_quantity_normalized = None
-                    extra_units = None
-                    if created:
-                        ingredient.save()
-                    if i['quantity_original']:
-                        try:
-                            units_normalized, quantity_normalized, extra_quantity_normalized, extra_units = normalize_quantity(
-                                i['quantity_original'])
-                        except Exception as e:
-                            recipe.delete_instance(recursive=True)
-                            log.error("Tags Table has some error...")
-                            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
-
-                    ingredient_quantity = RecipeIngredientQuantity(quantity_original=i['quantity_original'],
-                                                                   quantity_normalized=quantity_normalized,
-                                                                   units_normalized=units_normalized,
-                                                                   extra_quantity_normalized=extra_quantity_normalized,
-                                                                   extra_units=extra_units)
-                    ingredient_quantity.ingredient = ingredient
-                    ingredient_quantity.recipe = recipe
-                    ingredient_quantity.save()
+        log.info("Finished POST /recipe/list")
+        return Response(status=201)
 
-        except Exception as e:
-            recipe.delete_instance(recursive=True)
-            log.error("Ingredients Table has some error...")
-            return Response(status=400, response="Ingredients Table has some error.\n" + str(e))
 
-        recipe.save()
+@api.route("/bulk")
+class RecipeBulkResource(Resource):
 
-        log.info("Finished POST /recipe/list")
-        return Response(status=201)
+    @jwt_required()
+    def post(self):
+        """Create many recipes at once, from a json array or ndjson (one recipe per line)"""
+        """This shall be used by companies to load their catalogs"""
+
+        # logging
+        log.info("POST /recipe/bulk")
+
+        ## verify user
+
+        user = current_user
+
+        if user.user_type != USER_TYPE.COMPANY.value:
+            return Response(status=403, response="User is not a company.")
+
+        # read the recipes
+
+        if request.mimetype == "application/x-ndjson":
+            try:
+                items = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            except ValueError as e:
+                log.error("Invalid json...")
+                return Response(status=400, response="Invalid json.\n" + str(e))
+        else:
+            # None for a malformed body or another content type, instead of werkzeug's own error response
+            items = request.get_json(silent=True)
+            if items is None:
+                log.error("Invalid json...")
+                return Response(status=400, response="Invalid json.")
+
+        if not isinstance(items, list) or not items:
+            return Response(status=400, response="A non empty list of recipes must be supplied.")
+        if len(items) > BULK_MAX_ITEMS:
+            return Response(status=400, response=f"At most {BULK_MAX_ITEMS} recipes can be sent at once.")
+
+        # validate every recipe before writing any
+
+        results = [None] * len(items)
+        prepared = []
+        for index, item in enumerate(items):
+            try:
+                prepared.append((index, prepare_recipe(item)))
+            except InvalidRecipe as e:
+                results[index] = {"index": index, "status": 400, "errors": e.messages}
+
+        # one transaction per chunk, a failing chunk doesn't undo the ones before it
+
+        created_ids = []
+        for start in range(0, len(prepared), BULK_CHUNK_SIZE):
+            chunk = prepared[start:start + BULK_CHUNK_SIZE]
+            try:
+                recipe_ids = write_recipes([recipe for _, recipe in chunk], user)
+            except Exception as e:
+                log.error("Recipes chunk couldn't be created...")
+                for index, _ in chunk:
+                    results[index] = {"index": index, "status": 400, "errors": {"_schema": [str(e)]}}
+                continue
+
+            for (index, _), recipe_id in zip(chunk, recipe_ids):
+                results[index] = {"index": index, "status": 201, "id": recipe_id}
+            created_ids += recipe_ids
+
+        if created_ids:
+            index_recipes(created_ids)
+            response_cache.invalidate(RECIPE_LISTS)
+
+        response_holder = {"created": len(created_ids), "failed": len(items) - len(created_ids), "results": results}
+
+        log.info("Finished POST /recipe/bulk")
+        return Response(status=200, response=json.dumps(response_holder), mimetype="application/json")
 
 
 @api.route("/report")
@@ -1342,16 +1496,7 @@ class RecipeListResource(Resource):
 
         ## validate entities
 
-        user_id = get_jwt_identity()
-
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and stil reach this far)
-            # this only occurs when accounts are not in db, so in prod this wont happen
-            block_user_session_id()
-            log.error("User couln't be found.")
-            return Response(status=400, response="User couln't be found.")
+        user = current_user
 
         try:
             recipe = Recipe.get(args['id'])
@@ -4,15 +4,16 @@ from datetime import datetime, timezone
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, current_user
+from flask_restx import Namespace, Resource, inputs
 from marshmallow import ValidationError
 
 from .errors import return_error_sql
-from ...classes.functions import block_user_session_id
-from ...classes.models import User as UserDB, ShoppingList as ShoppingListDB, \
-    ShoppingIngredient as ShoppingIngredientDB, Ingredient as IngredientDB, USER_TYPE
-from ...classes.schemas import ShoppingListSchema, build_metadata, ShoppingListPatchSchema
+from ...classes.lookups import ingredient_lookup
+from ...classes.models import ShoppingList as ShoppingListDB, \
+    ShoppingIngredient as ShoppingIngredientDB, USER_TYPE
+from ...classes.pagination import offset_paginate
+from ...classes.schemas import ShoppingListSchema, build_page_metadata, ShoppingListPatchSchema
 from ...ext.logger import log
 
 api = Namespace("calendar", description="Here are all comment endpoints")
@@ -20,6 +21,8 @@ api = Namespace("calendar", description="Here are all comment endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument("id", type=int, help="ID of the calendar to delete")
 parser.add_argument('date', type=str, help='The date.')
 parser.add_argument('from_date', type=str, help='The left date delimiter.')
@@ -41,18 +44,12 @@ class ShoppingListResource(Resource):
         """
         log.info("Entering GET /shopping_list endpoint")
         args = parser.parse_args()
-        user_id = get_jwt_identity()
         page = args['page'] if args['page'] else 1
         page_size = args['page_size'] if args['page_size'] else 5
         id = args['id'] if args['id'] else None
         archived = args['archived'] if args['archived'] and 1 >= args['archived'] >= 0 else None
 
-        try:
-            user = UserDB.get(UserDB.id == user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found.")
-            return Response(status=400, response="User couldn't be found.")
+        user = current_user
 
         response_holder = {}
 
@@ -66,24 +63,20 @@ class ShoppingListResource(Resource):
             response_holder = ShoppingListSchema().dump(query, backrefs=True, recurse=True, manytomany=True)
         elif archived:
             query = ShoppingListDB.select().where((ShoppingListDB.user == user) & (ShoppingListDB.archived == archived))
-            total_shopping_lists = int(query.count())
-            total_pages = math.ceil(total_shopping_lists / page_size)
-            metadata = build_metadata(page, page_size, total_pages, total_shopping_lists, ENDPOINT)
-            response_holder["_metadata"] = metadata
+            page_query, total_shopping_lists, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_shopping_lists, has_next, ENDPOINT)
 
             shopping_list_data = []
-            for shopping_list in query.paginate(page, page_size):
+            for shopping_list in page_query:
                 shopping_list_schema = ShoppingListSchema().dump(shopping_list)
                 shopping_list_data.append(shopping_list_schema)
         else:
             query = ShoppingListDB.select().where((ShoppingListDB.user == user) & (ShoppingListDB.archived == False))
-            total_shopping_lists = int(query.count())
-            total_pages = math.ceil(total_shopping_lists / page_size)
-            metadata = build_metadata(page, page_size, total_pages, total_shopping_lists, ENDPOINT)
-            response_holder["_metadata"] = metadata
+            page_query, total_shopping_lists, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_shopping_lists, has_next, ENDPOINT)
 
             shopping_list_data = []
-            for shopping_list in query.paginate(page, page_size):
+            for shopping_list in page_query:
                 shopping_list_schema = ShoppingListSchema().dump(shopping_list)
                 shopping_list_data.append(shopping_list_schema)
 
@@ -98,7 +91,6 @@ class ShoppingListResource(Resource):
         Create a new shopping list entry.
         """
         log.info("Entering POST /shopping_list endpoint")
-        user_id = get_jwt_identity()
         json_data = request.get_json()
 
         try:
@@ -107,12 +99,7 @@ class ShoppingListResource(Resource):
             log.error("Invalid arguments: %s", err.messages)
             return Response(status=400, response=json.dumps(err.messages), mimetype="application/json")
 
-        try:
-            user = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found.")
-            return Response(status=400, response="User couldn't be found.")
+        user = current_user
 
         # check if user is premium
 
@@ -127,18 +114,19 @@ class ShoppingListResource(Resource):
         shopping_list_query = ShoppingListDB(name=shopping_list_validated["name"], user=user)
         shopping_list_query.save()
 
+        ingredient_names = ingredient_lookup.names(
+            [item["ingredient"]["id"] for item in shopping_list_validated['shopping_ingredients']])
+
         for item in shopping_list_validated['shopping_ingredients'].copy():
             shopping_ingredient_model = ShoppingIngredientDB(**item)
 
-            try:
-                ingredient_query = IngredientDB.get(item["ingredient"]["id"])
-            except peewee.DoesNotExist:
+            if item["ingredient"]["id"] not in ingredient_names:
                 log.error("Ingredient quantity ID not found: %s", item["ingredient"]["id"])
                 shopping_list_query.delete_instance()
                 return Response(status=400,
                                 response=f'Ingredient quantity couldnt be found by this id: {item["ingredient"]["id"]}')
 
-            shopping_ingredient_model.ingredient = ingredient_query
+            shopping_ingredient_model.ingredient = item["ingredient"]["id"]
             shopping_ingredient_model.shopping_list = shopping_list_query
             shopping_ingredient_model.save()
 
@@ -152,19 +140,13 @@ class ShoppingListResource(Resource):
         Patch a user by ID.
         """
         log.info("PATCH /shopping_list")
-        user_id = get_jwt_identity()
         args = parser.parse_args()
         id = args['id'] if args['id'] else None
 
         if not id:
             return Response(status=400, response="Id must be supplied.")
 
-        try:
-            user_query = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response=f'User couldnt be found by this id: {user_id}.')
+        user_query = current_user
 
         try:
             shopping_list_query = ShoppingListDB.get(
@@ -190,18 +172,19 @@ class ShoppingListResource(Resource):
                 for item in shopping_list_query.shopping_ingredients:
                     item.delete_instance()
 
+                ingredient_names = ingredient_lookup.names(
+                    [item["ingredient"]["id"] for item in shopping_list_schema['shopping_ingredients']])
+
                 for item in shopping_list_schema['shopping_ingredients'].copy():
                     shopping_ingredient_model = ShoppingIngredientDB(**item)
 
-                    try:
-                        ingredient_query = IngredientDB.get(item["ingredient"]["id"])
-                    except peewee.DoesNotExist:
+                    if item["ingredient"]["id"] not in ingredient_names:
                         log.error("Ingredient quantity ID not found: %s", item["ingredient"]["id"])
                         shopping_list_query.delete_instance()
                         return Response(status=400,
                                         response=f'Ingredient quantity couldnt be found by this id: {item["ingredient"]["id"]}')
 
-                    shopping_ingredient_model.ingredient = ingredient_query
+                    shopping_ingredient_model.ingredient = item["ingredient"]["id"]
                     shopping_ingredient_model.shopping_list = shopping_list_query
                     shopping_ingredient_model.save()
 
@@ -223,14 +206,8 @@ class ShoppingListResource(Resource):
         """
         log.info("DELETE /calendar")
         args = parser.parse_args()
-        user_id = get_jwt_identity()
 
-        try:
-            user_model = UserDB.get(UserDB.id == user_id)
-        except peewee.DoesNotExist:
-            block_user_session_id()
-            log.error("Client couldn't be found.")
-            return Response(status=400, response="Client couldn't be found.")
+        user_model = current_user
 
         if not args["id"]:
             log.error("Invalid arguments: 'id' is missing.")
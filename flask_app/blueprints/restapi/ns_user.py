@@ -4,13 +4,18 @@ from datetime import datetime, timezone
 
 import peewee
 from flask import Response, request
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from flask_restx import Namespace, Resource
+from flask_jwt_extended import jwt_required, get_jwt_identity, current_user
+from flask_restx import Namespace, Resource, inputs
 from playhouse.shortcuts import model_to_dict
 
 from .errors import return_error_sql
+from ...classes.hydration import hydrate_users
 from ...classes.models import User as UserDB
+from ...classes.pagination import offset_paginate
+from ...classes.search import index_user, user_match
 from ...classes.schemas import *
+from ...ext.cache import response_cache, user_tag, USER_LISTS, RECIPE_LISTS
+from ...ext.jwt import invalidate_user
 from ...ext.logger import log
 
 # Create name space
@@ -21,16 +26,23 @@ api = Namespace("Users", description="Here are all user endpoints")
 parser = api.parser()
 parser.add_argument('page', type=int, help='The page number.')
 parser.add_argument('page_size', type=int, help='The page size.')
+parser.add_argument('include_total', type=inputs.boolean, default=True,
+                    help='false skips the total count and only reports has_next.')
 parser.add_argument('id', type=str, help='The string to be search.')
 parser.add_argument('string', type=str, help='The string to be search.')
 
 ENDPOINT = "/user"
 
 
+def user_list_cache_tags(payload):
+    return {USER_LISTS} | {user_tag(user["id"]) for user in payload["result"]}
+
+
 # Create resources
 @api.route("/list")
 class UserListResource(Resource):
 
+    @response_cache.cached(user_list_cache_tags)
     def get(self):
         """List all users"""
 
@@ -62,21 +74,27 @@ class UserListResource(Resource):
 
             # build query
 
-            query = UserDB.select().where(UserDB.first_name.contains(string_to_search) |
-                                          UserDB.last_name.contains(string_to_search) |
-                                          UserDB.email.contains(string_to_search))
+            if '@' in string_to_search:
+                # emails are matched by prefix on their unique index
+                condition = UserDB.email.startswith(string_to_search)
+            else:
+                condition = user_match(string_to_search)
+
+            if condition is None:
+                log.error("Search string has no words")
+                return Response(status=400, response="Search string has no words")
+
+            query = UserDB.select().where(condition).order_by(UserDB.username)
 
             # metadata
 
-            total_users = int(query.count())
-            total_pages = math.ceil(total_users / page_size)
-            metadata = build_metadata(page, page_size, total_pages, total_users, ENDPOINT)
-            response_holder["_metadata"] = metadata
+            page_query, total_users, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_users, has_next, ENDPOINT)
 
             # response data
 
             recipes = []
-            for item in query.paginate(page, page_size):
+            for item in hydrate_users(page_query):
                 recipes.append(UserSchema().dump(item))
 
             response_holder["result"] = recipes
@@ -95,15 +113,13 @@ class UserListResource(Resource):
 
             # metadata
 
-            total_users = int(query.count())
-            total_pages = math.ceil(total_users / page_size)
-            metadata = build_metadata(page, page_size, total_pages, total_users, ENDPOINT)
-            response_holder["_metadata"] = metadata
+            page_query, total_users, has_next = offset_paginate(query, page, page_size, args['include_total'])
+            response_holder["_metadata"] = build_page_metadata(page, page_size, total_users, has_next, ENDPOINT)
 
             # response data
 
             recipes = []
-            for item in query.paginate(page, page_size):
+            for item in page_query:
                 recipes.append(UserSimpleSchema().dump(item))
 
             response_holder["result"] = recipes
@@ -181,24 +197,13 @@ class UserResource(Resource):
 
         log.info("DELETE /user")
 
-        # gets user auth id
-
-        user_logged_id = get_jwt_identity()
-
         # check if user exists
-        try:
-            user_logged = UserDB.get(user_logged_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
-            return Response(status=400, response="User couldn't be found by this id.")
+        user_logged = current_user
 
         try:
             user_logged.delete_instance(recursive=True)
+            response_cache.invalidate(user_tag(user_logged.id), USER_LISTS, RECIPE_LISTS)
+            invalidate_user(user_logged.id)
             log.info("Finished DELETE /user")
             return Response(status=200, response="User deleted successfully.")
         except peewee.IntegrityError as e:
@@ -212,18 +217,10 @@ class UserResource(Resource):
         log.info("PATCH /user")
 
         # gets user auth id
-        user_id = get_jwt_identity()
 
-        # check if user exists
-        try:
-            user_making_patch = UserDB.get(user_id)
-        except peewee.DoesNotExist:
-            # Otherwise block user token (user cant be logged in and still reach this far)
-            jti = get_jwt()["jti"]
-            now = datetime.now(timezone.utc)
-            token_block_record = TokenBlocklist(jti=jti, created_at=now)
-            token_block_record.save()
-            log.error("User couldn't be found by this id.")
+        # check if user exists, read again since current_user may come from the cache of this worker
+        user_making_patch = UserDB.get_or_none(UserDB.id == current_user.id)
+        if user_making_patch is None:
             return Response(status=400, response="User couldn't be found by this id.")
 
         # body
@@ -239,13 +236,19 @@ class UserResource(Resource):
         try:
             for key, value in user_validated.items():
                 if key == "password":
-                    authorized = user_making_patch.check_password(user_validated['old_password'])
+                    authorized = user_making_patch.check_password(user_validated.get('old_password'))
                     if not authorized:
                         return Response(status=400, response=json.dumps({'error': "Old password is incorrect."}), mimetype="application/json")
+                    value = user_making_patch.hash_password(value)
                 setattr(user_making_patch, key, value)
 
             user_making_patch.updated_date = datetime.now(timezone.utc)
-            user_making_patch.save()
+            # only the patched columns, a concurrent change to the others is kept
+            user_making_patch.save(only=user_making_patch.dirty_fields)
+            if 'username' in user_validated or 'name' in user_validated:
+                index_user(user_making_patch)
+            response_cache.invalidate(user_tag(user_making_patch.id))
+            invalidate_user(user_making_patch.id)
 
             log.info("Finished PATCH /user")
             return Response(status=200, response=json.dumps(
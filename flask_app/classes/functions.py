@@ -1,10 +1,12 @@
 import os
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 import requests
 from flask_jwt_extended import get_jwt, jwt_required
 
-from .models import UNITS_TYPE, NOTIFICATION_TYPE, TokenBlocklist, Notification
+from .models import UNITS_TYPE, NOTIFICATION_TYPE, Notification
+from ..ext.jwt import revoke_token
 from ..ext.logger import log
 import re
 
@@ -22,157 +24,126 @@ units_model = ['dente', 'folha', 'q.b.', 'ml', 'L', 'lata', 'fatia', 'g', 'gr',
                'rodela', 'cabeça', 'unid', 'porção', 'ramo', 'frasco', 'pés', 'saqueta']
 
 
-def normalize_quantity(quantity_original):
-    # general stuff
-
-    if "100 ml (+ 2 c. de sobremesa)" in quantity_original:
-        print()
-    # remover espaços
-    quantity_original = quantity_original.strip()
-
-    # trocar virgulas por pontos
-    quantity_original = quantity_original.replace(",", ".")
-
-    # remover +/- da string
-    if "(±)" in quantity_original:
-        quantity_original = quantity_original.replace("(±)", "").strip()
-    if "±" in quantity_original:
-        quantity_original = quantity_original.replace("±", "").strip()
-
-    if "+-" in quantity_original:
-        quantity_original = quantity_original.replace("+-", "").strip()
-
-    # remover fractions
-    if "½" in quantity_original or "1⁄2" in quantity_original:
-        quantity_original = quantity_original.replace("½", "0.5")
-        quantity_original = quantity_original.replace("1⁄2", "0.5")
-        helper = quantity_original.split(" ")
-        try:
-            value = float(helper[0]) + float(helper[1])
-            quantity_original = f'{value} {" ".join(helper[2:])}'
-        except ValueError:
-            pass
-    if "¼" in quantity_original:
-        quantity_original = quantity_original.replace("¼", "0.25")
-        helper = quantity_original.split(" ")
-        if helper[0].isdigit() and helper[1].isdigit():
-            value = float(helper[0]) + float(helper[1])
-            quantity_original = f'{value} {" ".join(helper[2:])}'
-
-    ## more specific general stuff
-
-    if quantity_original == "unid." or quantity_original == "1":
-        quantity_original = "1 unid."
-
-    if "q.b." in quantity_original:
-        quantity_original = "1 q.b."
-
-    # check for sums
-
-    if "+" in quantity_original:
-        helper = quantity_original.split("+", 1)
-        helper2 = helper[1].strip().split(" ")
-        try:
-            value = float(helper[0]) + float(helper2[0])
-            quantity_original = f'{value} {" ".join(helper[1:])}'
-        except ValueError:
-            pass
-
-    # main split
-    helper = quantity_original.split(" ", 1)
-
-    value = helper[0].strip()
-    units = helper[1].strip()
-
-    extra_units = None
-    extra_value_normalized = None
-
-    if " (" in units:
-        match = re.search(r'\(\s*([\d.]+)\s*(\D+)\s*\)', units)
-        if match:
-            units = units.split(" (")[0]
-            if extra_units not in ['c. de chá', 'c. de sopa', 'c. de sobremesa', 'c. sobremesa', 'c. de café', 'cháv.']:
-                extra_value_normalized, extra_units = match.groups()
+# spoons and cups are converted by volume, to the units of UNITS_TYPE
+MEASURE_CONVERSIONS = {
+    "chá": (UNITS_TYPE.GRAMS.value, COLHER_DE_CHA),
+    "sopa": (UNITS_TYPE.GRAMS.value, COLHER_DE_SOPA),
+    "sobremesa": (UNITS_TYPE.GRAMS.value, COLHER_DE_SOBREMESA),
+    "café": (UNITS_TYPE.GRAMS.value, COLHER_DE_CAFE),
+    "cháv": (UNITS_TYPE.MILILITROS.value, CHAVENA),
+}
+
+# weights end up in grams and volumes in milliliters, other units ('dentes', 'lata', ...) are kept as written
+UNIT_CONVERSIONS = {
+    "g": (UNITS_TYPE.GRAMS.value, 1),
+    "gr": (UNITS_TYPE.GRAMS.value, 1),
+    "kg": (UNITS_TYPE.GRAMS.value, 1000),
+    "ml": (UNITS_TYPE.MILILITROS.value, 1),
+    "cl": (UNITS_TYPE.MILILITROS.value, 10),
+    "dl": (UNITS_TYPE.MILILITROS.value, 100),
+    "l": (UNITS_TYPE.MILILITROS.value, 1000),
+}
+
+VULGAR_FRACTIONS = {"½": 0.5, "¼": 0.25, "¾": 0.75, "⅓": 1 / 3, "⅔": 2 / 3}
+
+# distinct quantity strings are few ('1 c. de sopa', '2 dentes', ...), so most calls are cache hits
+QUANTITY_CACHE_SIZE = 4096
+
+_FRACTIONS = "".join(VULGAR_FRACTIONS)
+# '1 1/2', '1/2', '1.5', '1 ½', '1½' or '½'
+_AMOUNT = rf"(?:\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?\s*[{_FRACTIONS}]?|[{_FRACTIONS}])"
+_AMOUNT_PART = re.compile(rf"\d+/\d+|\d+(?:\.\d+)?|[{_FRACTIONS}]")
+_APPROXIMATELY = re.compile(r"\(±\)|±|\+-")
+# amount, an optional '+ amount', the units and an optional '(...)' with the extra quantity
+_QUANTITY = re.compile(rf"^(?P<value>{_AMOUNT})(?:\s*\+\s*(?P<plus>{_AMOUNT}))?\s*(?P<units>[^(]*?)"
+                       rf"\s*(?:\((?P<extra>[^)]*)\).*)?$")
+# '2x250g', '4 x 80 g'
+_MULTIPACK = re.compile(r"^(\d+)\s*x\s*(\d+(?:\.\d+)?)\s*(\D+)$")
+_MEASURE = re.compile(r"c\.\s*(?:de\s+)?(chá|sopa|sobremesa|café)|(cháv)")
+
+
+def _amount(text):
+    value = 0.0
+    for part in _AMOUNT_PART.findall(text):
+        if part in VULGAR_FRACTIONS:
+            value += VULGAR_FRACTIONS[part]
+        elif "/" in part:
+            numerator, denominator = part.split("/")
+            value += int(numerator) / int(denominator)
         else:
-            # the cases '(2x250g) (4x80 g)'
-            pattern = r'\((\d+)x(\d+)\s*(\w+)\)'
-            match = re.search(pattern, units)
-            extra_value_normalized = 0
-            if match:
-                quantity, weight, extra_units = match.groups()
-                extra_value_normalized += int(quantity) * int(weight)
-                helper = units.split(" (")
-                units = helper[0]
-            else:
-                helper = units.split(" (")
-                units = helper[0]
-
-    if 'c. de chá' in units:
-        try:
-            return UNITS_TYPE.GRAMS.value, float(value) * COLHER_DE_CHA, None, None
-        except:
-            # Se o quantity_helper não der para ser parsed
-            log.debug(f"Quantity_helper was unable to be parsed: {value}")
-            return -1
-    elif 'c. de sopa' in quantity_original:
-
-        try:
-            return UNITS_TYPE.GRAMS.value, float(value) * COLHER_DE_SOPA, None, None
-        except:
-            # Se o quantity_helper não der para ser parsed
-            log.debug(f"Quantity_helper was unable to be parsed {value}")
-            return -1
-    elif 'c. de sobremesa' in quantity_original or 'c. sobremesa' in quantity_original:
-        try:
-            return UNITS_TYPE.GRAMS.value, float(value) * COLHER_DE_SOPA, None, None
-        except:
-            # Se o quantity_helper não der para ser parsed
-            log.debug(f"Quantity_helper was unable to be parsed {value}")
-            return -1
-    elif 'c. de café' in quantity_original:
-
-        try:
-            return UNITS_TYPE.GRAMS.value, float(value) * COLHER_DE_CAFE, None, None
-        except:
-            # Se o quantity_helper não der para ser parsed
-            log.debug(f"Quantity_helper was unable to be parsed {value}")
-            return -1
-    elif 'cháv.' in quantity_original:
-
-        try:
-            return UNITS_TYPE.MILILITROS.value, float(value) * CHAVENA, None, None
-        except:
-            # Se o quantity_helper não der para ser parsed
-            log.debug(f"Quantity_helper was unable to be parsed {value}")
-            return -1
-
-    # deal whit extra
-
-    if (extra_units == "g"):
-        helper_var = units
-        helper_var2 = value
-        units = extra_units
-        value = extra_value_normalized
-        extra_units = helper_var
-        extra_value_normalized = helper_var2
-
-    # make evertthing in the same units
-
-    if extra_units == "kg":
-        extra_units = "g"
-        extra_value_normalized = float(extra_value_normalized) * 1000
-    if extra_units == "L":
-        extra_units = "ml"
-        extra_value_normalized = float(extra_value_normalized) * 1000
-
-    if units == "kg":
-        units = "g"
-        value = float(value) * 1000
-    if units == "L":
-        units = "ml"
-        value = float(value) * 1000
-
-    return units, value, extra_units, extra_value_normalized
+            value += float(part)
+    return value
+
+
+def _convert(units, value):
+    """ (units, value, is_measure) in the normalized units """
+    measure = _MEASURE.search(units)
+    if measure:
+        units, factor = MEASURE_CONVERSIONS[measure.group(1) or measure.group(2)]
+        return units, value * factor, True
+
+    units, factor = UNIT_CONVERSIONS.get(units.lower().rstrip("."), (units, 1))
+    return units, value * factor, False
+
+
+def _extra_quantity(text):
+    """ (units, value, additive) of the text between parenthesis, None when it isn't a quantity """
+    text = text.strip()
+    additive = text.startswith("+")
+    text = text.lstrip("+").strip()
+
+    pack = _MULTIPACK.match(text)
+    if pack:
+        count, size, units = pack.groups()
+        units, value, _ = _convert(units.strip(), int(count) * float(size))
+        return units, value, additive
+
+    match = _QUANTITY.match(text)
+    if not match or not match.group("units") or match.group("extra"):
+        return None
+
+    units, value, _ = _convert(match.group("units"), _amount(match.group("value")))
+    return units, value, additive
+
+
+@lru_cache(maxsize=QUANTITY_CACHE_SIZE)
+def normalize_quantity(quantity_original):
+    """
+    Parses an ingredient quantity such as '1 ½ cháv.', '2 latas (400 g)' or '3 c. de sopa' into
+    (units, value, extra_units, extra_value), converted with MEASURE_CONVERSIONS and UNIT_CONVERSIONS.
+    Raises ValueError when the text isn't a quantity.
+    """
+
+    # '1,5' is 1.5, '1⁄2' is 1/2 and the approximately marks don't change the quantity
+    text = _APPROXIMATELY.sub("", quantity_original.replace(",", ".").replace("⁄", "/"))
+    text = " ".join(text.split())
+
+    if "q.b." in text:
+        return "q.b.", 1.0, None, None
+    if text == "unid.":
+        return "unid.", 1.0, None, None
+
+    match = _QUANTITY.match(text)
+    if not match:
+        raise ValueError(f"Quantity '{quantity_original}' couldn't be parsed.")
+
+    value = _amount(match.group("value"))
+    if match.group("plus"):
+        value += _amount(match.group("plus"))
+
+    units, value, is_measure = _convert(match.group("units") or "unid.", value)
+
+    extra = _extra_quantity(match.group("extra")) if match.group("extra") and not is_measure else None
+    if extra is None:
+        return units, value, None, None
+
+    extra_units, extra_value, additive = extra
+
+    # a weight between parenthesis is the precise quantity, '2 latas (400 g)' is 400 g of 2 latas
+    if extra_units == UNITS_TYPE.GRAMS.value and units != UNITS_TYPE.GRAMS.value and not additive:
+        return extra_units, extra_value, units, value
+
+    return units, value, extra_units, extra_value
 
 
 def parse_date(date_str):
@@ -227,10 +198,7 @@ def push_notification(reciever_user, notification_type):
 
 @jwt_required()
 def block_user_session_id():
-    jti = get_jwt()["jti"]
-    now = datetime.now(timezone.utc)
-    token_block_record = TokenBlocklist(jti=jti, created_at=now)
-    token_block_record.save()
+    revoke_token(get_jwt())
 
 
 def calculate_age(birth_date: datetime):
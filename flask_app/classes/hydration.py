@@ -0,0 +1,135 @@
+from collections import defaultdict
+
+from peewee import fn
+
+from .models import Recipe, RecipeTagThrough, RecipeIngredientQuantity, Tag, Ingredient, NutritionInformation, User, \
+    Follow, FollowRequest, Goal
+
+''' Recipes '''
+
+
+RECIPE_RELATIONS = ("tags", "ingredients", "nutrition_information", "created_by")
+
+
+def load_recipes(ranked, columns=(Recipe,)):
+    """
+    Second half of a deferred join: the listing query only reads ids from its sort index and
+    the columns of the recipes of that page are read here by primary key, keeping the page order.
+    """
+
+    recipe_ids = [recipe.id for recipe in ranked]
+    if not recipe_ids:
+        return []
+
+    recipes = {recipe.id: recipe for recipe in Recipe.select(*columns).where(Recipe.id.in_(recipe_ids))}
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+def hydrate_recipes(recipes, relations=RECIPE_RELATIONS):
+    """
+    Loads the relations RecipeSchema needs for a page of recipes using grouped IN (...) queries,
+    so the number of queries doesn't depend on the page size. Counters come from the recipe row.
+    relations limits the loading to the ones the response dumps.
+    """
+
+    recipes = list(recipes)
+
+    if not recipes or not relations:
+        return recipes
+
+    recipe_ids = [recipe.id for recipe in recipes]
+
+    # Recipe.tags reads the through rows from this backref when it holds a list
+    if "tags" in relations:
+        tags = defaultdict(list)
+        for through in (RecipeTagThrough
+                        .select(RecipeTagThrough, Tag)
+                        .join(Tag)
+                        .where(RecipeTagThrough.recipe.in_(recipe_ids))
+                        .order_by(RecipeTagThrough.id)):
+            tags[through.recipe_id].append(through)
+
+        for recipe in recipes:
+            recipe.tagrecipethrough_set = tags[recipe.id]
+
+    if "ingredients" in relations:
+        ingredients = defaultdict(list)
+        for ingredient_quantity in (RecipeIngredientQuantity
+                                    .select(RecipeIngredientQuantity, Ingredient)
+                                    .join(Ingredient)
+                                    .where(RecipeIngredientQuantity.recipe.in_(recipe_ids))
+                                    .order_by(RecipeIngredientQuantity.id)):
+            ingredients[ingredient_quantity.recipe_id].append(ingredient_quantity)
+
+        for recipe in recipes:
+            recipe.ingredients = ingredients[recipe.id]
+
+    if "nutrition_information" in relations:
+        nutrition_ids = {recipe.nutrition_information_id for recipe in recipes if recipe.nutrition_information_id}
+        if nutrition_ids:
+            nutrition_information = {item.id: item for item in
+                                     NutritionInformation.select().where(NutritionInformation.id.in_(nutrition_ids))}
+
+            for recipe in recipes:
+                if recipe.nutrition_information_id in nutrition_information:
+                    recipe.nutrition_information = nutrition_information[recipe.nutrition_information_id]
+
+    if "created_by" in relations:
+        user_ids = {recipe.created_by_id for recipe in recipes}
+        users = {user.id: user for user in User.select().where(User.id.in_(user_ids))}
+
+        for recipe in recipes:
+            if recipe.created_by_id in users:
+                recipe.created_by = users[recipe.created_by_id]
+
+    return recipes
+
+
+''' Users '''
+
+
+USER_RELATIONS = ("follows", "follow_requests", "fitness_goal")
+
+
+def _count_by(model, field, user_ids):
+    return dict(model.select(field, fn.COUNT(model.id)).where(field.in_(user_ids)).group_by(field).tuples())
+
+
+def hydrate_users(users, relations=USER_RELATIONS):
+    """
+    Loads the follow counters and the current goal UserSchema dumps for a page of users using
+    grouped queries, instead of the COUNT and goal queries its pre_dump runs for a single user.
+    """
+
+    users = list(users)
+
+    if not users or not relations:
+        return users
+
+    user_ids = list({user.id for user in users})
+
+    if "follows" in relations:
+        followers = _count_by(Follow, Follow.followed, user_ids)
+        followeds = _count_by(Follow, Follow.follower, user_ids)
+
+        for user in users:
+            user.followers_count = followers.get(user.id, 0)
+            user.followeds_count = followeds.get(user.id, 0)
+
+    if "follow_requests" in relations:
+        followers_request = _count_by(FollowRequest, FollowRequest.followed, user_ids)
+        followeds_request = _count_by(FollowRequest, FollowRequest.follower, user_ids)
+
+        for user in users:
+            user.followers_request_count = followers_request.get(user.id, 0)
+            user.followeds_request_count = followeds_request.get(user.id, 0)
+
+    if "fitness_goal" in relations:
+        # the last goal of each user
+        latest = Goal.select(fn.MAX(Goal.id)).where(Goal.user.in_(user_ids)).group_by(Goal.user)
+        goals = {goal.user_id: goal for goal in Goal.select().where(Goal.id.in_(latest))}
+
+        for user in users:
+            user.fitness_goal = goals.get(user.id)
+
+    return users
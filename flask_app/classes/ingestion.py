@@ -0,0 +1,114 @@
+import os
+
+from marshmallow import ValidationError
+
+from .functions import normalize_quantity
+from .lookups import tag_lookup, ingredient_lookup
+from .models import Recipe, RecipeTagThrough, RecipeIngredientQuantity, NutritionInformation, UNITS_TYPE, db
+from .schemas import RecipeSchema
+
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE')) if os.environ.get('BULK_CHUNK_SIZE') else 100
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS')) if os.environ.get('BULK_MAX_ITEMS') else 5000
+
+
+class InvalidRecipe(ValueError):
+    """ A recipe of a bulk load that can't be written, messages is sent back in its result """
+
+    def __init__(self, messages):
+        super().__init__(messages)
+        self.messages = messages
+
+
+''' Validation '''
+
+
+def normalize_ingredients(ingredients):
+    """
+    The RecipeIngredientQuantity columns of validated ingredients, plus the ingredient name.
+    Raises ValueError when a quantity can't be parsed.
+    """
+
+    rows = []
+    for item in ingredients:
+        units, quantity, extra_units, extra_quantity = UNITS_TYPE.GRAMS.value, float(0), None, None
+        if item['quantity_original']:
+            units, quantity, extra_units, extra_quantity = normalize_quantity(item['quantity_original'])
+
+        rows.append({"name": item['ingredient']['name'],
+                     "quantity_original": item['quantity_original'],
+                     "quantity_normalized": quantity,
+                     "units_normalized": units,
+                     "extra_quantity": extra_quantity,
+                     "extra_units": extra_units})
+    return rows
+
+
+def prepare_recipe(data):
+    """
+    Validates one recipe of a bulk load with RecipeSchema and normalizes its quantities,
+    without touching the database. Raises InvalidRecipe.
+    """
+
+    if not isinstance(data, dict):
+        raise InvalidRecipe({"_schema": ["A recipe must be an object."]})
+
+    # like /recipe/company, the nutrition table id of an exported recipe is ignored
+    if isinstance(data.get('nutrition_information'), dict):
+        data['nutrition_information'].pop('id', None)
+
+    try:
+        recipe = RecipeSchema().load(data)
+    except ValidationError as err:
+        raise InvalidRecipe(err.messages)
+
+    try:
+        recipe['ingredients'] = normalize_ingredients(recipe.pop('ingredients') or [])
+    except ValueError as e:
+        raise InvalidRecipe({"ingredients": [str(e)]})
+
+    recipe['tags'] = list(dict.fromkeys(tag['title'] for tag in recipe.get('tags') or []))
+    return recipe
+
+
+''' Writing '''
+
+
+def ingredient_rows(recipe_id, ingredients, ingredient_ids):
+    """ RecipeIngredientQuantity rows for insert_many from normalize_ingredients and the ingredient ids by name """
+    return [dict({key: value for key, value in item.items() if key != 'name'},
+                 recipe=recipe_id, ingredient=ingredient_ids[item['name']]) for item in ingredients]
+
+
+def write_recipes(recipes, user):
+    """
+    Writes a chunk of prepared recipes created by user in one transaction and returns their ids.
+    Tags and ingredients are resolved once for the whole chunk, mostly from the lookups cache, and the
+    children are written with one INSERT per table, so the queries don't grow with the number of items.
+    """
+
+    # resolved before the transaction, a rollback must not leave ids of rows that never existed in the cache
+    tag_ids = tag_lookup.ids(sorted({title for recipe in recipes for title in recipe['tags']}))
+    ingredient_ids = ingredient_lookup.ids(sorted({item['name'] for recipe in recipes
+                                                   for item in recipe['ingredients']}))
+
+    with db.atomic():
+        recipe_ids, tags, ingredients = [], [], []
+        for recipe in recipes:
+            fields = {key: value for key, value in recipe.items() if key not in ('tags', 'ingredients')}
+
+            nutrition_table = fields.pop('nutrition_information', None)
+            if nutrition_table:
+                fields['nutrition_information'] = NutritionInformation.create(**nutrition_table)
+
+            recipe_id = Recipe.create(created_by=user, **fields).id
+            recipe_ids.append(recipe_id)
+
+            tags += [{"recipe": recipe_id, "tag": tag_ids[title]} for title in recipe['tags']]
+            ingredients += ingredient_rows(recipe_id, recipe['ingredients'], ingredient_ids)
+
+        if tags:
+            RecipeTagThrough.insert_many(tags).execute()
+        if ingredients:
+            RecipeIngredientQuantity.insert_many(ingredients).execute()
+
+    return recipe_ids
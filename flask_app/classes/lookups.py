@@ -0,0 +1,120 @@
+import os
+
+from .models import Tag, Ingredient
+from .search import fold
+from ..ext.cache import LRUCache
+
+LOOKUP_MAX_ENTRIES = int(os.environ.get('LOOKUP_MAX_ENTRIES')) if os.environ.get('LOOKUP_MAX_ENTRIES') else 10000
+LOOKUP_TTL = int(os.environ.get('LOOKUP_TTL')) if os.environ.get('LOOKUP_TTL') else 3600
+
+
+class NameLookup:
+    """
+    Bounded name <-> id cache of a small, read mostly table (tags, ingredients), kept per worker.
+    Rows are never renamed, so an entry only leaves by eviction or after LOOKUP_TTL seconds.
+    """
+
+    def __init__(self, model, field, max_entries=LOOKUP_MAX_ENTRIES, ttl=LOOKUP_TTL):
+        self.model = model
+        self.field = field
+        self._ids = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._names = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def _remember(self, rows):
+        generation = self._ids.generation()
+        for row_id, name in rows:
+            self._ids.set(name, row_id, (), generation)
+            self._names.set(row_id, name, (), generation)
+
+    def _read(self, condition):
+        rows = list(self.model.select(self.model.id, self.field).where(condition).tuples())
+        self._remember(rows)
+        return rows
+
+    def _read_names(self, names, exact=True):
+        rows = self._read(self.field.in_(names))
+        found = {name: row_id for row_id, name in rows}
+        if exact:
+            return {name: found[name] for name in names if name in found}
+
+        # the column collation ignores case and accents, so 'Sal' may come back as 'sal',
+        # the stored spellings read above are matched in memory
+        folded = {fold(name): row_id for row_id, name in rows}
+        generation = self._ids.generation()
+        for name in names:
+            if name not in found and fold(name) in folded:
+                found[name] = folded[fold(name)]
+                self._ids.set(name, found[name], (), generation)
+        return {name: found[name] for name in names if name in found}
+
+    def warm(self):
+        """ Loads the first max_entries rows, called when a worker starts """
+        rows = list(self.model.select(self.model.id, self.field)
+                    .order_by(self.model.id)
+                    .limit(self._ids.max_entries)
+                    .tuples())
+        self._remember(rows)
+        return len(rows)
+
+    def ids(self, names):
+        """
+        {name: id} for names, creating the missing rows. Created ids are cached right away, so call it
+        outside of transactions that may roll back. Raises ValueError naming the rows that couldn't be created.
+        """
+
+        found = {}
+        for name in dict.fromkeys(names):
+            row_id = self._ids.get(name)
+            if row_id is not None:
+                found[name] = row_id
+
+        missing = [name for name in dict.fromkeys(names) if name not in found]
+        if missing:
+            found.update(self._read_names(missing))
+
+        missing = [name for name in missing if name not in found]
+        if missing:
+            # another worker may be inserting the same names, only a duplicate key is let through (unlike
+            # INSERT IGNORE, which also hides data errors) and whatever won is read back
+            (self.model
+             .insert_many([{self.field.name: name} for name in missing])
+             .on_conflict(update={self.model.id: self.model.id})
+             .execute())
+            found.update(self._read_names(missing, exact=False))
+
+        # e.g. a name the column stored truncated
+        missing = [name for name in missing if name not in found]
+        if missing:
+            raise ValueError(f"{self.model.__name__} couldn't be created for: {', '.join(map(repr, missing))}")
+
+        return found
+
+    def id(self, name):
+        return self.ids([name])[name]
+
+    def names(self, ids):
+        """ {id: name} for the ids that exist """
+
+        found = {}
+        for row_id in dict.fromkeys(ids):
+            name = self._names.get(row_id)
+            if name is not None:
+                found[row_id] = name
+
+        missing = [row_id for row_id in dict.fromkeys(ids) if row_id not in found]
+        if missing:
+            found.update({row_id: name for row_id, name in self._read(self.model.id.in_(missing))})
+
+        return found
+
+    def clear(self):
+        self._ids.clear()
+        self._names.clear()
+
+
+tag_lookup = NameLookup(Tag, Tag.title)
+ingredient_lookup = NameLookup(Ingredient, Ingredient.name)
+
+
+def warm_lookups():
+    return tag_lookup.warm(), ingredient_lookup.warm()
@@ -1,4 +1,8 @@
+import ast
+import json
 import os
+import pickle
+import random
 from abc import ABC
 from datetime import datetime
 from enum import Enum
@@ -7,10 +11,11 @@ from marshmallow import EXCLUDE
 from playhouse.shortcuts import ReconnectMixin
 
 from peewee import TextField, FloatField, CharField, DateTimeField, BooleanField, IntegerField, BlobField, \
-    ForeignKeyField, ManyToManyField, fn, JOIN
-from flask_bcrypt import generate_password_hash, check_password_hash
+    ForeignKeyField, ManyToManyField, fn, JOIN, Value
 from peewee import Model, MySQLDatabase
 
+from flask_app.ext.bycrypt import hash_password, check_password
+
 db_user = os.environ.get('MYSQL_ROOT') if os.environ.get('MYSQL_ROOT') else 'root'
 db_password = os.environ.get('MYSQL_ROOT_PASSWORD') if os.environ.get('MYSQL_ROOT_PASSWORD') else ''
 database = os.environ.get('MYSQL_DATABASE') if os.environ.get('MYSQL_DATABASE') else 'flask_api'
@@ -136,10 +141,10 @@ class User(UpdatableBaseModel):
     age = CharField(null=False)
 
     def hash_password(self, password):
-        return generate_password_hash(password).decode('utf8')
+        return hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return check_password(self.password, password)
 
 
 ''' Goals '''
@@ -166,12 +171,23 @@ class FollowRequest(BaseModel):
 
     class Meta:
         db_table = 'follow_request'
+        # the requests of a user are listed newest first
+        indexes = (
+            (('followed', 'created_date'), False),
+        )
 
 
 class Follow(BaseModel):
     follower = ForeignKeyField(User, backref='followeds')
     followed = ForeignKeyField(User, backref='followers')
 
+    class Meta:
+        # followers and followeds are listed newest first
+        indexes = (
+            (('followed', 'created_date'), False),
+            (('follower', 'created_date'), False),
+        )
+
 
 ''' Recipe '''
 
@@ -198,6 +214,36 @@ class NutritionInformation(EmptyModel):
         db_table = 'nutrition_information'
 
 
+class PreparationField(BlobField):
+    """ Preparation steps stored as compact JSON, still reads the encodings written before it """
+
+    def db_value(self, value):
+        if value is not None and not isinstance(value, (bytes, bytearray)):
+            value = json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+        return super().db_value(value)
+
+    def python_value(self, value):
+        if value is None:
+            return None
+        return decode_preparation(bytes(value))
+
+
+def decode_preparation(raw):
+    # pickle.dumps, the original format (protocol 2+ starts with 0x80)
+    if raw[:1] == b'\x80':
+        return pickle.loads(raw)
+
+    text = raw.decode()
+    try:
+        return json.loads(text)
+    except ValueError:
+        # str(steps).encode(), written by older versions of PUT /recipe
+        return ast.literal_eval(text)
+
+
+RANDOM_RANK_RANGE = 2 ** 31 - 1
+
+
 class Recipe(UpdatableBaseModel):
     title = CharField(null=False)
     description = CharField(null=False)
@@ -209,7 +255,8 @@ class Recipe(UpdatableBaseModel):
     time = CharField(null=True)
 
     views = IntegerField(default=0, null=False)
-    preparation = BlobField(null=False)
+    # list of {step, description}, see PreparationField
+    preparation = PreparationField(null=False)
 
     created_by = ForeignKeyField(User, backref='created_recipes')
     nutrition_information = ForeignKeyField(NutritionInformation, backref='recipe', null=True, on_delete='CASCADE')
@@ -217,16 +264,50 @@ class Recipe(UpdatableBaseModel):
     source_rating = FloatField(null=True)
     source_link = CharField(null=True)
 
+    # denormalized counters, kept in sync by the like/save/rating/comment endpoints
+    # and rebuilt by the recount_recipes command
+    likes_count = IntegerField(default=0, null=False, index=True)
+    saves_count = IntegerField(default=0, null=False, index=True)
+    comments_count = IntegerField(default=0, null=False)
+    rating_sum = IntegerField(default=0, null=False)
+    rating_count = IntegerField(default=0, null=False)
+    # rating_sum / rating_count kept as a column so CLASSIFICATION reads an index instead of sorting every recipe
+    rating_average = FloatField(default=0, null=False, index=True)
+
+    # precomputed position for the seeded RANDOM sort, reshuffled by the shuffle_recipes command
+    random_rank = IntegerField(default=lambda: random.randrange(RANDOM_RANK_RANGE), null=False, index=True)
+
     def get_average_rating(self):
-        avg_rating = RecipeRating.select(fn.AVG(RecipeRating.rating)).where(RecipeRating.recipe == self).scalar()
-        return avg_rating or 0.0
+        if not self.rating_count:
+            return 0.0
+        return self.rating_sum / self.rating_count
 
     def get_likes(self):
-        likes = RecipeBackground.select().where(
-            (RecipeBackground.recipe == self) & (
-                    RecipeBackground.type == RECIPES_BACKGROUND_TYPE.LIKED.value)).count()
+        return self.likes_count or 0
+
+    @classmethod
+    def update_counters(cls, recipe_id, **deltas):
+        """ Adds deltas to the counters, e.g. update_counters(1, likes_count=1) """
+        with cls._meta.database.atomic():
+            updated = (cls
+                       .update({getattr(cls, counter): getattr(cls, counter) + delta for counter, delta in deltas.items()})
+                       .where(cls.id == recipe_id)
+                       .execute())
 
-        return likes or 0
+            # a second UPDATE, so the average reads the committed counters whatever order the SET list is applied in
+            if "rating_sum" in deltas or "rating_count" in deltas:
+                cls.rating_average_update(recipe_id).execute()
+
+        return updated
+
+    @classmethod
+    def rating_average_update(cls, recipe_id):
+        """ The UPDATE setting rating_average from the stored rating_sum and rating_count """
+        # unconverted, the IntegerField would send 1.0 as 1 and some databases then divide integers
+        rating_sum = cls.rating_sum * Value(1.0, converter=False)
+        return (cls
+                .update({cls.rating_average: fn.COALESCE(rating_sum / fn.NULLIF(cls.rating_count, 0), 0)})
+                .where(cls.id == recipe_id))
 
 
 class RecipeRating(BaseModel):
@@ -278,6 +359,28 @@ class Comment(UpdatableBaseModel):
     user = ForeignKeyField(User, backref='comments')
 
 
+class RecipeSearchDocument(EmptyModel):
+    # accent folded text of the recipe, searched through the FULLTEXT indexes created by classes.search
+    recipe = ForeignKeyField(Recipe, primary_key=True, backref='search_document', on_delete='CASCADE')
+    document = TextField(null=False)
+    tags = TextField(null=False, default='')
+
+    class Meta:
+        db_table = 'recipe_search_document'
+
+
+class UserSearchToken(EmptyModel):
+    # accent folded words of the username and name, searched by prefix on the token index by classes.search
+    user = ForeignKeyField(User, backref='search_tokens', on_delete='CASCADE')
+    token = CharField(null=False)
+
+    class Meta:
+        db_table = 'user_search_token'
+        indexes = (
+            (('token', 'user'), True),
+        )
+
+
 class RecipeReport(BaseModel):
     title = CharField(null=False)
     message = CharField(null=False)
@@ -349,7 +452,21 @@ class ApplicationReport(UpdatableBaseModel):
 
 
 class TokenBlocklist(BaseModel):
-    jti = CharField()
+    jti = CharField(index=True)
 
     class Meta:
         db_table = 'token_block_list'
+        # read by created_date watermark in ext.jwt and purged by age
+        indexes = (
+            (('created_date',), False),
+        )
+
+
+class SchemaVersion(EmptyModel):
+    # one row per migration applied by flask_app.migrations, the schema version is the highest one
+    version = IntegerField(primary_key=True)
+    name = CharField(null=False)
+    applied_date = DateTimeField(default=datetime.now, null=False)
+
+    class Meta:
+        db_table = 'schema_version'
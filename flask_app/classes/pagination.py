@@ -0,0 +1,209 @@
+import hashlib
+import os
+from datetime import datetime
+
+from flask import current_app
+from itsdangerous import URLSafeSerializer, BadData
+
+from ..ext.cache import LRUCache
+
+CURSOR_SALT = "pagination-cursor"
+COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL')) if os.environ.get('COUNT_CACHE_TTL') else 30
+
+# totals of recent listings, so paging through one doesn't count the same rows on every page
+_count_cache = LRUCache(max_entries=1024, ttl=COUNT_CACHE_TTL)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+''' Cursors '''
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt=CURSOR_SALT)
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values, scope=None):
+    """ Builds an opaque signed cursor from the sort key values of the last row of a page """
+    return _serializer().dumps({"s": scope, "k": [_dump_value(value) for value in values]})
+
+
+def decode_cursor(cursor, scope=None):
+    try:
+        payload = _serializer().loads(cursor)
+    except BadData:
+        raise InvalidCursor("Invalid cursor.")
+
+    # a cursor is only valid for the listing (sort) it was created for
+    if payload.get("s") != scope:
+        raise InvalidCursor("Cursor doesn't belong to this listing.")
+
+    return [_load_value(value) for value in payload["k"]]
+
+
+''' Offset pagination '''
+
+
+def cached_count(query):
+    """ COUNT of query, reused for COUNT_CACHE_TTL seconds by any query with the same sql and params """
+
+    # the order doesn't change the total, so all the sorts of a listing share it
+    sql, params = query.order_by().sql()
+    key = hashlib.sha256(f"{sql}|{params!r}".encode()).hexdigest()
+
+    total = _count_cache.get(key)
+    if total is None:
+        generation = _count_cache.generation()
+        total = int(query.count())
+        _count_cache.set(key, total, (), generation)
+    return total
+
+
+def offset_paginate(query, page, page_size, include_total=True):
+    """
+    Reads one page of query with OFFSET, fetching one extra row to know if there is a next page.
+    Returns the rows, the total (None without include_total) and has_next.
+    """
+
+    rows = list(query.offset((page - 1) * page_size).limit(page_size + 1))
+    total = cached_count(query) if include_total else None
+
+    return rows[:page_size], total, len(rows) > page_size
+
+
+''' Keyset pagination '''
+
+
+def _seek(keys, values):
+    # (k1, k2, ...) after (v1, v2, ...), expanded so MySQL can range scan the index:
+    # k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...
+    condition = None
+    for position, (key, descending) in enumerate(keys):
+        term = key < values[position] if descending else key > values[position]
+        for previous_position in range(position):
+            term = (keys[previous_position][0] == values[previous_position]) & term
+        condition = term if condition is None else condition | term
+    return condition
+
+
+def keyset_order(keys):
+    return [key.desc() if descending else key.asc() for key, descending in keys]
+
+
+def keyset_paginate(query, keys, cursor, page_size, scope=None):
+    """
+    Reads one page of query seeking past the cursor instead of using OFFSET.
+
+    keys is a list of (expression, descending) tuples and must end with a unique column (usually id).
+    An empty cursor returns the first page. Returns the rows and the cursor of the next page, or None
+    when there are no more rows.
+    """
+
+    if cursor:
+        values = decode_cursor(cursor, scope)
+        if len(values) != len(keys):
+            raise InvalidCursor("Cursor doesn't belong to this listing.")
+        query = query.where(_seek(keys, values))
+
+    aliases = [f"cursor_key_{position}" for position in range(len(keys))]
+
+    query = (query
+             .select_extend(*[key.alias(alias) for (key, _), alias in zip(keys, aliases)])
+             .order_by(*keyset_order(keys))
+             .limit(page_size + 1))
+
+    rows = list(query)
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([getattr(rows[-1], alias) for alias in aliases], scope)
+
+    return rows, next_cursor
+
+
+''' Seeded random order '''
+
+
+def seed_start(seed, rank_range):
+    """ Maps a seed to the rank where its rotation of the random_rank order starts """
+    digest = hashlib.sha256(str(seed).encode()).digest()
+    return int.from_bytes(digest[:8], "big") % rank_range
+
+
+def _rotation(query, rank, start):
+    # the rotation starting at start is the index range rank >= start followed by the range rank < start
+    return [query.where(rank >= start), query.where(rank < start)]
+
+
+def rotated_page(query, rank, unique, start, offset, limit):
+    """ OFFSET pagination of query in the rotated rank order, reading the two index ranges in turn """
+
+    rows = []
+    for segment_query in _rotation(query, rank, start):
+        segment_query = segment_query.order_by(rank, unique)
+
+        if offset:
+            # skip the whole range when the page starts after it
+            segment_size = segment_query.count()
+            if offset >= segment_size:
+                offset -= segment_size
+                continue
+
+        rows += list(segment_query.offset(offset).limit(limit - len(rows)))
+        offset = 0
+        if len(rows) >= limit:
+            break
+
+    return rows
+
+
+def rotated_paginate(query, rank, unique, start, cursor, page_size, scope=None):
+    """
+    Keyset pagination of query in the rotated rank order. The cursor holds the range of the last row
+    and its (rank, unique) values, so the next page seeks straight into the index.
+    """
+
+    keys = [(rank, False), (unique, False)]
+
+    segment, values = 0, None
+    if cursor:
+        decoded = decode_cursor(cursor, scope)
+        if len(decoded) != len(keys) + 1 or decoded[0] not in (0, 1):
+            raise InvalidCursor("Cursor doesn't belong to this listing.")
+        segment, values = decoded[0], decoded[1:]
+
+    segments = _rotation(query, rank, start)
+    rows = []
+    while segment < len(segments) and len(rows) <= page_size:
+        segment_query = segments[segment]
+        if values:
+            segment_query = segment_query.where(_seek(keys, values))
+
+        rows += [(segment, row) for row in
+                 segment_query.order_by(*keyset_order(keys)).limit(page_size + 1 - len(rows))]
+
+        if len(rows) <= page_size:
+            segment, values = segment + 1, None
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last_segment, last = rows[-1]
+        next_cursor = encode_cursor([last_segment, getattr(last, rank.name), getattr(last, unique.name)], scope)
+
+    return [row for _, row in rows], next_cursor
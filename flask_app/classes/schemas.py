@@ -1,13 +1,14 @@
 import json
-import pickle
+import math
 import re
 from datetime import timedelta
 
-from marshmallow import fields, validates, pre_dump, pre_load, ValidationError, validate
+from marshmallow import fields, validates, pre_dump, ValidationError, validate
 from peewee import fn
 
 from flask_app.classes.constants import USER_MIN_WEIGHT, USER_MAX_WEIGHT, USER_MIN_HEIGHT, USER_MAX_HEIGHT, \
     STRING_USER_BIRTHDATE_YOUNG_ERROR, STRING_USER_BIRTHDATE_PAST_ERROR
+from flask_app.classes.hydration import RECIPE_RELATIONS, hydrate_users
 from flask_app.classes.models import *
 from flask_app.ext.schema import ma
 
@@ -51,6 +52,44 @@ def build_metadata(page, page_size, total_pages, total_units, ENDPOINT):
     return _metadata
 
 
+def build_page_metadata(page, page_size, total_units, has_next, ENDPOINT):
+    """ build_metadata for offset pages, without total_pages/total_items when total_units is None """
+
+    if total_units is not None:
+        return build_metadata(page, page_size, math.ceil(total_units / page_size), total_units, ENDPOINT)
+
+    _metadata = {"current_page": page, "items_per_page": page_size, "has_next": has_next}
+
+    if has_next:
+        _metadata['next'] = f"/api/v1{ENDPOINT}?page={page + 1}&page_size={page_size}&include_total=false"
+    if page > 1:
+        _metadata['previous'] = f"/api/v1{ENDPOINT}?page={page - 1}&page_size={page_size}&include_total=false"
+
+    return _metadata
+
+
+_cursor_metadata_template = {
+
+    "items_per_page": 0,
+    "next_cursor": None,
+    "next": None
+}
+
+
+def build_cursor_metadata(page_size, next_cursor, ENDPOINT):
+    _metadata = _cursor_metadata_template.copy()
+
+    if next_cursor:
+        _metadata['next_cursor'] = next_cursor
+        _metadata['next'] = f"/api/v1{ENDPOINT}?cursor={next_cursor}&page_size={page_size}"
+    else:
+        _metadata.pop('next_cursor')
+        _metadata.pop('next')
+    _metadata['items_per_page'] = page_size
+
+    return _metadata
+
+
 class MetadataSchema(ma.Schema):
     page = fields.Integer(required=True)
     page_count = fields.Integer(required=True)
@@ -116,6 +155,10 @@ class UserSimpleSchema(ma.Schema):
         unknown = EXCLUDE
 
 
+# the only User columns UserSimpleSchema reads
+USER_SIMPLE_COLUMNS = [User._meta.fields[name] for name in UserSimpleSchema._declared_fields]
+
+
 class RecipeBackgroundSimplifiedSchema(ma.Schema):
     id = fields.Integer(required=True)
     user = fields.Nested(UserSimpleSchema, required=True)
@@ -189,14 +232,9 @@ class RecipeSchema(ma.Schema):
 
     @pre_dump
     def unlist(self, data, **kwargs):
-        # decode blob
-
-        if data.preparation:
-            data.preparation = pickle.loads(data.preparation)
-
         data.likes = data.get_likes()
 
-        data.comments = data.comments.count()
+        data.comments = data.comments_count
         data.rating = data.get_average_rating()
         return data
 
@@ -214,7 +252,7 @@ class RecipeSimpleSchema(ma.Schema):
     likes = fields.Integer(default=0, required=False)
     views = fields.Integer(default=0, required=False)
 
-    rating = fields.String(required=False)
+    rating = fields.Float(default=0.0)
     source_rating = fields.String(required=False)
     source_link = fields.String(required=False)
     company = fields.String(required=False)
@@ -228,6 +266,55 @@ class RecipeSimpleSchema(ma.Schema):
     class Meta:
         ordered = True
 
+    @pre_dump
+    def unlist(self, data, **kwargs):
+        data.likes = data.get_likes()
+        data.rating = data.get_average_rating()
+        return data
+
+
+''' Recipe projections '''
+
+RECIPE_VIEWS = ("card", "full")
+
+# columns behind the dumped fields that aren't a column of the same name
+_recipe_field_columns = {
+    "likes": [Recipe.likes_count],
+    "rating": [Recipe.rating_sum, Recipe.rating_count],
+    "comments": [Recipe.comments_count],
+    "nutrition_information": [Recipe.nutrition_information],
+    "created_by": [Recipe.created_by],
+}
+
+
+def recipe_projection(view=None, only=None):
+    """
+    Picks the schema for a view (full by default, or card) or for a comma separated list of RecipeSchema
+    fields, and returns it with the Recipe columns to select and the relations to hydrate.
+    Raises ValueError for an unknown view or field.
+    """
+
+    if only:
+        # id is always sent, clients need it to open the recipe
+        names = ["id"] + [name.strip() for name in only.split(",") if name.strip() and name.strip() != "id"]
+        schema = RecipeSchema(only=names)
+    elif view == "card":
+        # the list screens, no relations and no preparation blob
+        schema = RecipeSimpleSchema(only=("id", "title", "img_source", "likes", "rating"))
+    elif not view or view == "full":
+        return RecipeSchema(), [Recipe], RECIPE_RELATIONS
+    else:
+        raise ValueError(f"view must be one of {', '.join(RECIPE_VIEWS)}.")
+
+    columns = {}
+    for name in schema.fields:
+        for column in _recipe_field_columns.get(name, [Recipe._meta.fields.get(name)]):
+            if column is not None:
+                columns[column.name] = column
+
+    relations = tuple(name for name in RECIPE_RELATIONS if name in schema.fields)
+    return schema, list(columns.values()), relations
+
 
 class RecipeBackgroundSchema(ma.Schema):
     class Meta:
@@ -332,28 +419,26 @@ class UserSchema(ma.Schema):
             raise ValidationError(f"User height must be between {USER_MIN_HEIGHT} cm and {USER_MAX_HEIGHT} cm.")
         return value
 
-    @pre_load
-    def hash_password(self, data, **kwargs):
-        if 'password' in data:
-            data['password'] = generate_password_hash(data['password'])
-        return data
-
     @pre_dump()
     def goal(self, data, **kwargs):
 
-        data.fitness_goal = data.goals.order_by(Goal.id.desc()).first()
-
+        # pages of users are loaded by hydrate_users
+        if not hasattr(data, "fitness_goal"):
+            hydrate_users([data], ("fitness_goal",))
 
         return data
 
     @pre_dump()
     def recipes(self, data, **kwargs):
 
-        data.followers = data.followers.count()
-        data.followeds = data.followeds.count()
+        if not hasattr(data, "followers_request_count"):
+            hydrate_users([data], ("follows", "follow_requests"))
 
-        data.followers_request = data.followers_request.count()
-        data.followeds_request = data.followeds_request.count()
+        data.followers = data.followers_count
+        data.followeds = data.followeds_count
+
+        data.followers_request = data.followers_request_count
+        data.followeds_request = data.followeds_request_count
 
         return data
 
@@ -405,8 +490,11 @@ class UserPerfilSchema(ma.Schema):
 
     @pre_dump()
     def follows(self, data, **kwargs):
-        data.followers = data.followers.count()
-        data.followeds = data.followeds.count()
+        if not hasattr(data, "followeds_count"):
+            hydrate_users([data], ("follows",))
+
+        data.followers = data.followers_count
+        data.followeds = data.followeds_count
 
         return data
 
@@ -459,9 +547,9 @@ class CalenderEntryRecipeSchema(ma.Schema):
 
     @pre_dump
     def unlist(self, data, **kwargs):
-        # decode blob
-        if 'preparation' in data:
-            data['preparation'] = json.loads(data['preparation'].decode().replace("\'", "\""))
+        # the raw blob, when the dict wasn't built from a loaded Recipe
+        if isinstance(data.get('preparation'), (bytes, bytearray)):
+            data['preparation'] = decode_preparation(bytes(data['preparation']))
 
         data['likes'] = RecipeBackground.select().where(
             (RecipeBackground.recipe == data['id']) & (
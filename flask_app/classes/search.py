@@ -0,0 +1,173 @@
+import re
+
+from playhouse.mysql_ext import Match
+from text_unidecode import unidecode
+
+from .hydration import hydrate_recipes
+from .models import Recipe, RecipeSearchDocument, User, UserSearchToken
+
+SEARCH_TOKEN = re.compile(r"\w+")
+# user words also split at underscores, so 'joao_silva' is found by 'silva'
+USER_TOKEN = re.compile(r"[^\W_]+")
+USER_TOKEN_SIZE = 64
+MIN_TOKEN_SIZE = 3
+
+FULLTEXT_INDEXES = {
+    "recipe_search_document_document": "document",
+    "recipe_search_document_tags": "tags",
+}
+
+
+def fold(text):
+    """ Lower case ascii version of text, so 'Pão' and 'pao' index and search the same way """
+    return unidecode(text or "").lower()
+
+
+''' Index '''
+
+
+def ensure_fulltext_indexes():
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so only missing indexes are created
+    database = RecipeSearchDocument._meta.database
+    table = RecipeSearchDocument._meta.table_name
+
+    existing = {index.name for index in database.get_indexes(table)}
+    for name, column in FULLTEXT_INDEXES.items():
+        if name not in existing:
+            database.execute_sql(f"CREATE FULLTEXT INDEX {name} ON {table} ({column})")
+
+
+def build_document(recipe):
+    tags = " ".join(tag.title for tag in recipe.tags)
+    ingredients = " ".join(ingredient_quantity.ingredient.name for ingredient_quantity in recipe.ingredients)
+
+    # the title is repeated so it weighs more on the relevance score
+    document = " ".join([recipe.title, recipe.title, recipe.description or "", tags, ingredients])
+
+    return {"recipe": recipe.id, "document": fold(document), "tags": fold(tags)}
+
+
+def index_recipe(recipe_id):
+    """ (Re)builds the search document of a recipe, call it after the recipe, its tags and ingredients are saved """
+    index_recipes([recipe_id])
+
+
+def index_recipes(recipe_ids):
+    """ index_recipe for many recipes, with one hydration and one INSERT for all of them """
+
+    recipes = hydrate_recipes(Recipe
+                              .select(Recipe.id, Recipe.title, Recipe.description)
+                              .where(Recipe.id.in_(list(recipe_ids))),
+                              ("tags", "ingredients"))
+    if recipes:
+        (RecipeSearchDocument
+         .insert_many([build_document(recipe) for recipe in recipes])
+         .on_conflict_replace()
+         .execute())
+
+
+def rebuild_index(chunk_size=500):
+    ensure_fulltext_indexes()
+
+    last_id = 0
+    while True:
+        # only what build_document reads
+        recipes = hydrate_recipes(Recipe
+                                  .select(Recipe.id, Recipe.title, Recipe.description)
+                                  .where(Recipe.id > last_id)
+                                  .order_by(Recipe.id)
+                                  .limit(chunk_size),
+                                  ("tags", "ingredients"))
+        if not recipes:
+            break
+
+        with RecipeSearchDocument._meta.database.atomic():
+            (RecipeSearchDocument
+             .insert_many([build_document(recipe) for recipe in recipes])
+             .on_conflict_replace()
+             .execute())
+
+        last_id = recipes[-1].id
+
+
+''' User index '''
+
+
+def user_tokens(user):
+    username = fold(user.username)
+    tokens = set(USER_TOKEN.findall(username)) | set(USER_TOKEN.findall(fold(user.name)))
+    tokens.add(username)
+    return {token[:USER_TOKEN_SIZE] for token in tokens if token}
+
+
+def index_users(users):
+    """ (Re)builds the search tokens of users, call it after their username or name are saved """
+
+    users = list(users)
+    if not users:
+        return
+
+    with UserSearchToken._meta.database.atomic():
+        UserSearchToken.delete().where(UserSearchToken.user.in_([user.id for user in users])).execute()
+        UserSearchToken.insert_many([{"user": user.id, "token": token}
+                                     for user in users for token in user_tokens(user)]).execute()
+
+
+def index_user(user):
+    index_users([user])
+
+
+def rebuild_user_index(chunk_size=500):
+    last_id = 0
+    while True:
+        users = list(User
+                     .select(User.id, User.username, User.name)
+                     .where(User.id > last_id)
+                     .order_by(User.id)
+                     .limit(chunk_size))
+        if not users:
+            break
+
+        index_users(users)
+        last_id = users[-1].id
+
+
+''' Search '''
+
+
+def _boolean_query(text):
+    tokens = SEARCH_TOKEN.findall(fold(text))
+
+    # words shorter than innodb_ft_min_token_size aren't indexed ('de', 'a'), unless they are all there is
+    tokens = [token for token in tokens if len(token) >= MIN_TOKEN_SIZE] or tokens
+
+    # every word is required and matched as a prefix, so half typed words still find results
+    return " ".join(f"+{token}*" for token in tokens)
+
+
+def has_search_terms(text):
+    return bool(SEARCH_TOKEN.search(fold(text)))
+
+
+def document_match(text):
+    """ Relevance of the recipe document for text, also usable as a filter (0 when it doesn't match) """
+    return Match(RecipeSearchDocument.document, _boolean_query(text), "IN BOOLEAN MODE")
+
+
+def tags_match(text):
+    return Match(RecipeSearchDocument.tags, _boolean_query(text), "IN BOOLEAN MODE")
+
+
+def user_match(text):
+    """
+    Filter of the users that have, for every word of text, a username or name word starting with it.
+    Each word is one range read of the token index, so it doesn't scan the user table.
+    """
+
+    condition = None
+    for token in dict.fromkeys(USER_TOKEN.findall(fold(text))):
+        users = (UserSearchToken
+                 .select(UserSearchToken.user)
+                 .where(UserSearchToken.token.startswith(token[:USER_TOKEN_SIZE])))
+        condition = User.id.in_(users) if condition is None else condition & User.id.in_(users)
+    return condition
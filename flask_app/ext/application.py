@@ -1,7 +1,11 @@
+import os
+
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 def create_app():
     app = Flask(__name__)
     app.wsgi_app = ProxyFix(app.wsgi_app)
+    # signs the pagination cursors
+    app.config["SECRET_KEY"] = os.environ.get('SECRET_KEY') if os.environ.get('SECRET_KEY') else 'super-secret'
     return app
\ No newline at end of file
@@ -1,7 +1,65 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt as _bcrypt
 from flask_bcrypt import Bcrypt
 from flask_marshmallow import Marshmallow,fields
 
+# work factor of new hashes, a stored hash with another one is rehashed at the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS')) if os.environ.get('BCRYPT_ROUNDS') else 12
+# hashing processes per worker, more concurrent logins wait in line. 0 hashes in the calling thread
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS')) if os.environ.get('BCRYPT_WORKERS') else 2
+
 bcrypt = Bcrypt()
 
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _hash(password, rounds):
+    return _bcrypt.hashpw(password.encode('utf-8'), _bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(pw_hash, password):
+    return _bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def _run(function, *args):
+    """ Runs a bcrypt call in the pool, so the request thread only waits instead of holding the CPU """
+    global _pool, _pool_pid
+
+    if not BCRYPT_WORKERS:
+        return function(*args)
+
+    with _pool_lock:
+        # gunicorn forks the workers, each one needs its own processes
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+            _pool_pid = os.getpid()
+
+    return _pool.submit(function, *args).result()
+
+
+def hash_password(password):
+    return _run(_hash, password, BCRYPT_ROUNDS)
+
+
+def check_password(pw_hash, password):
+    if not pw_hash or password is None:
+        return False
+    return _run(_check, pw_hash, password)
+
+
+def needs_rehash(pw_hash):
+    """ True when the hash was made with another work factor, e.g. '$2b$10$...' with BCRYPT_ROUNDS 12 """
+    try:
+        return int(pw_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
 def init_app(app):
+    app.config["BCRYPT_LOG_ROUNDS"] = BCRYPT_ROUNDS
     bcrypt.init_app(app)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, request
+
+from flask_app.ext.logger import log
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES')) if os.environ.get('CACHE_MAX_ENTRIES') else 2048
+CACHE_TTL = int(os.environ.get('CACHE_TTL')) if os.environ.get('CACHE_TTL') else 300
+REDIS_URL = os.environ.get('REDIS_URL')
+
+''' Tags '''
+
+# every cached recipe listing, dropped when recipes are created or deleted
+RECIPE_LISTS = "recipes"
+# every cached user listing, dropped when users are created or deleted
+USER_LISTS = "users"
+
+
+def recipe_tag(recipe_id):
+    return f"recipe:{recipe_id}"
+
+
+def user_tag(user_id):
+    return f"user:{user_id}"
+
+
+def recipe_list_tag(kind):
+    """ Recipe listings whose membership or order depends on kind (a sort type, SEARCH, ...) """
+    return f"recipes:{kind}"
+
+
+''' Backends '''
+
+
+class LRUCache:
+    """ Bounded in-process cache, entries expire after ttl seconds and can be dropped by tag """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, tags, expires_at = item
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, tags, generation):
+        with self._lock:
+            # something was invalidated while the response was being built, it may already be stale
+            if generation != self._generation:
+                return
+
+            self._remove(key)
+            self._entries[key] = (entry, tags, time.monotonic() + self.ttl)
+            for tag in tags:
+                self._tags[tag].add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, set()):
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[1]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """ Cache shared by all the workers, each tag is a redis set holding the keys tagged with it """
+
+    PREFIX = "response-cache"
+
+    def __init__(self, url, ttl=CACHE_TTL):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"{self.PREFIX}:entry:{key}"
+
+    def _tag(self, tag):
+        return f"{self.PREFIX}:tag:{tag}"
+
+    def generation(self):
+        return int(self.client.get(f"{self.PREFIX}:generation") or 0)
+
+    def get(self, key):
+        value = self.client.get(self._key(key))
+        return json.loads(value) if value else None
+
+    def set(self, key, entry, tags, generation):
+        if generation != self.generation():
+            return
+
+        pipeline = self.client.pipeline()
+        pipeline.set(self._key(key), json.dumps(entry), ex=self.ttl)
+        for tag in tags:
+            pipeline.sadd(self._tag(tag), self._key(key))
+            pipeline.expire(self._tag(tag), self.ttl)
+        pipeline.execute()
+
+    def invalidate(self, tags):
+        self.client.incr(f"{self.PREFIX}:generation")
+        for tag in tags:
+            keys = self.client.smembers(self._tag(tag))
+            self.client.delete(self._tag(tag), *keys)
+
+    def clear(self):
+        self.client.incr(f"{self.PREFIX}:generation")
+        for key in self.client.scan_iter(f"{self.PREFIX}:*"):
+            if not key.endswith(b":generation"):
+                self.client.delete(key)
+
+
+''' Response cache '''
+
+
+def _etag(body):
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caches the 200 responses of public GET endpoints, keyed on the path and the sorted query args.
+    Every response carries a strong ETag and a matching If-None-Match is answered with 304.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache()
+
+    def init_app(self, app):
+        if REDIS_URL and redis is not None:
+            self.backend = RedisCache(REDIS_URL)
+            log.info("Response cache using redis.")
+        elif REDIS_URL:
+            log.error("REDIS_URL is set but redis isn't installed, response cache is per worker.")
+
+    def cached(self, tags, skip=None):
+        """
+        tags(payload) returns the tags of a response from its decoded json body. skip() is checked per request,
+        a true result answers it without reading or writing the cache.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if skip is not None and skip():
+                    return view(*args, **kwargs)
+
+                key = self._request_key()
+
+                entry = self.backend.get(key)
+                if entry is not None:
+                    return self._respond(entry, "HIT")
+
+                generation = self.backend.generation()
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+
+                body = response.get_data(as_text=True)
+                entry = {"body": body, "etag": _etag(body), "mimetype": response.mimetype}
+                self.backend.set(key, entry, set(tags(json.loads(body))), generation)
+
+                return self._respond(entry, "MISS")
+
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, *tags):
+        self.backend.invalidate(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    @staticmethod
+    def _request_key():
+        return f"{request.path}?{urlencode(sorted(request.args.items(multi=True)))}"
+
+    @staticmethod
+    def _respond(entry, status):
+        headers = {"ETag": f'"{entry["etag"]}"', "Cache-Control": "no-cache", "X-Cache": status}
+
+        if entry["etag"] in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        return Response(status=200, response=entry["body"], mimetype=entry["mimetype"], headers=headers)
+
+
+response_cache = ResponseCache()
+
+
+def init_app(app):
+    response_cache.init_app(app)
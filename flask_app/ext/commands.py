@@ -1,10 +1,27 @@
 
+import click
+
+from flask_app import migrations
+from flask_app.classes import search
+
 
 def init_app(app,db):
     ## import db model, otherwise it will not create table
     @app.cli.command("create_db")
     def create_db():
-        db.create_tables()
+        # kept for the old deploy scripts, same as migrate
+        db.migrate()
+
+    @app.cli.command("migrate")
+    @click.option("--to", "target", default=None, type=int, help="Stop after this version.")
+    def migrate(target):
+        versions = db.migrate(target)
+        click.echo(f"{len(versions)} migrations applied, schema at version {migrations.current_version()}.", err=True)
+
+    @app.cli.command("migration_status")
+    def migration_status():
+        for version, name, applied_date in migrations.status():
+            click.echo(f"{version:04d} {name:<32} {applied_date or 'pending'}")
 
     @app.cli.command("create_super_user")
     def create_super_user():
@@ -14,10 +31,62 @@ def init_app(app,db):
     def drop_db():
         db.drop_tables()
 
+    @app.cli.command("recount_recipes")
+    @click.option("--chunk-size", default=500, help="Recipes rebuilt per transaction.")
+    def recount_recipes(chunk_size):
+        db.recount_recipes(chunk_size)
+
+    @app.cli.command("shuffle_recipes")
+    @click.option("--chunk-size", default=500, help="Recipes reshuffled per transaction.")
+    def shuffle_recipes(chunk_size):
+        db.shuffle_recipes(chunk_size)
+
+    @app.cli.command("migrate_preparation")
+    @click.option("--chunk-size", default=500, help="Recipes converted per transaction.")
+    def migrate_preparation(chunk_size):
+        db.migrate_preparation(chunk_size)
+
+    @app.cli.command("renormalize_quantities")
+    @click.option("--chunk-size", default=1000, help="Ingredient quantities read and written per transaction.")
+    @click.option("--workers", default=None, type=int, help="Parser processes, all the cpus by default, 1 for none.")
+    @click.option("--dry-run", is_flag=True, help="Only report what would change.")
+    @click.option("--checkpoint", default=None, help="File with the last written id, a stopped run resumes from it.")
+    @click.option("--report", default=None, type=click.File("w"), help="CSV of the changed rows, stdout on dry runs.")
+    def renormalize_quantities(chunk_size, workers, dry_run, checkpoint, report):
+        if dry_run and report is None:
+            report = click.get_text_stream("stdout")
+        stats = db.renormalize_quantities(chunk_size, workers, dry_run, checkpoint, report)
+        click.echo(f"{stats['read']} quantities read, {stats['changed']} "
+                   f"{'would change' if dry_run else 'changed'}, {stats['failed']} couldn't be parsed.", err=True)
+
+    @app.cli.command("purge_revoked_tokens")
+    @click.option("--chunk-size", default=1000, help="Blocklist rows deleted per statement.")
+    def purge_revoked_tokens(chunk_size):
+        click.echo(f"{db.purge_revoked_tokens(chunk_size)} revoked tokens purged.", err=True)
+
+    @app.cli.command("rebuild_search_index")
+    @click.option("--chunk-size", default=500, help="Recipes indexed per transaction.")
+    def rebuild_search_index(chunk_size):
+        search.rebuild_index(chunk_size)
+
+    @app.cli.command("rebuild_user_index")
+    @click.option("--chunk-size", default=500, help="Users indexed per transaction.")
+    def rebuild_user_index(chunk_size):
+        search.rebuild_user_index(chunk_size)
+
 
     app.cli.add_command(create_db)
+    app.cli.add_command(migrate)
+    app.cli.add_command(migration_status)
     app.cli.add_command(drop_db)
     app.cli.add_command(create_super_user)
+    app.cli.add_command(recount_recipes)
+    app.cli.add_command(rebuild_search_index)
+    app.cli.add_command(rebuild_user_index)
+    app.cli.add_command(shuffle_recipes)
+    app.cli.add_command(migrate_preparation)
+    app.cli.add_command(renormalize_quantities)
+    app.cli.add_command(purge_revoked_tokens)
 
 #     @app.cli.command("add_student")
 #     def add_student_to_db():
@@ -1,7 +1,17 @@
-from peewee import IntegrityError
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+from peewee import IntegrityError, Case
 
 from flask_app.classes.models import *
 from flask_app.classes.schemas import UserSchema
+from flask_app.classes.functions import normalize_quantity
+from flask_app.classes.lookups import warm_lookups
+from flask_app.classes.search import index_user
+from flask_app.ext.bycrypt import hash_password
+from flask_app.ext.jwt import TOKEN_MAX_LIFETIME
+from flask_app.ext.logger import log
+from flask_app import migrations
 
 user = os.environ.get('MYSQL_ROOT') if os.environ.get('MYSQL_ROOT') else "root"
 password = os.environ.get('MYSQL_ROOT_PASSWORD') if os.environ.get('MYSQL_ROOT_PASSWORD') else ""
@@ -9,6 +19,26 @@ database = os.environ.get('MYSQL_DATABASE') if os.environ.get('MYSQL_DATABASE')
 host = os.environ.get('MYSQL_HOST') if os.environ.get('MYSQL_HOST') else "localhost"
 
 
+def _normalize_or_none(quantity_original):
+    # runs in the renormalize_quantities pool, so it must be a module level function
+    if not quantity_original:
+        return UNITS_TYPE.GRAMS.value, float(0), None, None
+    try:
+        return normalize_quantity(quantity_original)
+    except ValueError:
+        return None
+
+
+def _same_quantity(old, new):
+    for old_value, new_value in zip(old, new):
+        if isinstance(new_value, float) and old_value is not None:
+            if abs(old_value - new_value) > 1e-6:
+                return False
+        elif old_value != new_value:
+            return False
+    return True
+
+
 class ReconectMySQLDatabase(ReconnectMixin, MySQLDatabase):
     pass
 
@@ -18,7 +48,7 @@ db = ReconectMySQLDatabase(database=database, user=user, password=password,
 
 models = [TokenBlocklist, NutritionInformation, Recipe,RecipeRating, RecipeBackground, Tag, User, RecipeTagThrough, Comment, Follow,
           Ingredient, RecipeIngredientQuantity, CalendarEntry, FollowRequest, Notification, ShoppingIngredient,
-          ShoppingList,RecipeReport,ApplicationReport,Goal]
+          ShoppingList,RecipeReport,ApplicationReport,Goal,RecipeSearchDocument,UserSearchToken]
 
 
 class Database(object):
@@ -27,22 +57,44 @@ class Database(object):
         self.app = app
         self.db = db
         self.register_handlers()
-        self.create_tables()
-        self.create_super_user()
+        # every worker builds its app, the schema is changed once by flask migrate
+        if self.check_schema():
+            self.warm_lookups()
+
+    def check_schema(self):
+        """ True when the database is at the version of the code, a single query """
+        version = migrations.current_version()
+        if version < migrations.LATEST_VERSION:
+            log.error(f"Database schema is at version {version}, the code needs {migrations.LATEST_VERSION}. "
+                      f"Run flask migrate.")
+            return False
+        if version > migrations.LATEST_VERSION:
+            log.info(f"Database schema is at version {version}, newer than the code's {migrations.LATEST_VERSION}.")
+        return True
 
-    def create_tables(self):
-        return db.create_tables(models)
+    def migrate(self, target=None):
+        return migrations.migrate(self, target)
+
+    def warm_lookups(self):
+        # every worker builds its app, so each one starts with the tag and ingredient names in memory
+        tags, ingredients = warm_lookups()
+        log.info(f"Lookups warmed with {tags} tags and {ingredients} ingredients.")
 
     def drop_tables(self):
-        return db.drop_tables(models)
+        return db.drop_tables(models + [SchemaVersion])
 
     def create_super_user(self):
 
         # super user
         super_user_email = os.environ.get('SUPER_USER') if os.environ.get('SUPER_USER') else "root@root.com"
         super_user_password = os.environ.get('SUPER_USER_PASSWORD') if os.environ.get('SUPER_USER_PASSWORD') else "root"
+
+        # run at every container start, don't pay for a hash that would be thrown away
+        if User.select().where(User.email == super_user_email).exists():
+            return
+
         try:
-            super_user = User.create(**UserSchema().load({
+            data = UserSchema().load({
                 "name": "John Doe",
                 "username": "John Doe",
                 "birth_date": "15/03/2000",
@@ -50,12 +102,205 @@ class Database(object):
                 "password": super_user_password,
                 "description": "",
                 "user_type": "A"
-            }))
+            })
+            data['password'] = hash_password(data['password'])
+            super_user = User.create(**data)
             super_user.age = 1
             super_user.save()
+            index_user(super_user)
         except IntegrityError:
             pass
 
+    def recount_recipes(self, chunk_size=500):
+        """ Rebuilds the denormalized recipe counters from their source tables, one chunk of recipes at a time """
+
+        last_id = 0
+        while True:
+            recipe_ids = [recipe_id for recipe_id, in Recipe.select(Recipe.id)
+                          .where(Recipe.id > last_id)
+                          .order_by(Recipe.id)
+                          .limit(chunk_size)
+                          .tuples()]
+            if not recipe_ids:
+                break
+
+            likes, saves = {}, {}
+            for recipe_id, background_type, total in (RecipeBackground
+                                                      .select(RecipeBackground.recipe, RecipeBackground.type,
+                                                              fn.COUNT(RecipeBackground.id))
+                                                      .where(RecipeBackground.recipe.in_(recipe_ids))
+                                                      .group_by(RecipeBackground.recipe, RecipeBackground.type)
+                                                      .tuples()):
+                if background_type == RECIPES_BACKGROUND_TYPE.LIKED.value:
+                    likes[recipe_id] = total
+                elif background_type == RECIPES_BACKGROUND_TYPE.SAVED.value:
+                    saves[recipe_id] = total
+
+            comments = dict(Comment
+                            .select(Comment.recipe, fn.COUNT(Comment.id))
+                            .where(Comment.recipe.in_(recipe_ids))
+                            .group_by(Comment.recipe)
+                            .tuples())
+
+            ratings = {recipe_id: (int(rating_sum or 0), rating_count) for recipe_id, rating_sum, rating_count in
+                       RecipeRating
+                       .select(RecipeRating.recipe, fn.SUM(RecipeRating.rating), fn.COUNT(RecipeRating.rating))
+                       .where(RecipeRating.recipe.in_(recipe_ids))
+                       .group_by(RecipeRating.recipe)
+                       .tuples()}
+
+            # rating is nullable, a recipe can have rating rows and still no rating counted
+            averages = {recipe_id: rating_sum / rating_count if rating_count else 0
+                        for recipe_id, (rating_sum, rating_count) in ratings.items()}
+
+            # one UPDATE ... CASE per chunk
+            with Recipe._meta.database.atomic():
+                Recipe.update({
+                    Recipe.likes_count: Case(Recipe.id, [(i, likes.get(i, 0)) for i in recipe_ids], 0),
+                    Recipe.saves_count: Case(Recipe.id, [(i, saves.get(i, 0)) for i in recipe_ids], 0),
+                    Recipe.comments_count: Case(Recipe.id, [(i, comments.get(i, 0)) for i in recipe_ids], 0),
+                    Recipe.rating_sum: Case(Recipe.id, [(i, ratings.get(i, (0, 0))[0]) for i in recipe_ids], 0),
+                    Recipe.rating_count: Case(Recipe.id, [(i, ratings.get(i, (0, 0))[1]) for i in recipe_ids], 0),
+                    Recipe.rating_average: Case(Recipe.id, [(i, averages.get(i, 0)) for i in recipe_ids], 0),
+                }).where(Recipe.id.in_(recipe_ids)).execute()
+
+            last_id = recipe_ids[-1]
+
+    def shuffle_recipes(self, chunk_size=500):
+        """ Draws a new random_rank for every recipe, changing the order of all seeded RANDOM listings """
+
+        last_id = 0
+        while True:
+            recipe_ids = [recipe_id for recipe_id, in Recipe.select(Recipe.id)
+                          .where(Recipe.id > last_id)
+                          .order_by(Recipe.id)
+                          .limit(chunk_size)
+                          .tuples()]
+            if not recipe_ids:
+                break
+
+            # short transactions so the recipe table isn't locked for the whole run
+            with Recipe._meta.database.atomic():
+                (Recipe
+                 .update(random_rank=fn.FLOOR(fn.RAND() * RANDOM_RANK_RANGE))
+                 .where(Recipe.id.in_(recipe_ids))
+                 .execute())
+
+            last_id = recipe_ids[-1]
+
+    def purge_revoked_tokens(self, chunk_size=1000):
+        """ Deletes the blocklist rows of tokens that have expired anyway, oldest first """
+
+        oldest = datetime.now() - TOKEN_MAX_LIFETIME
+        purged = 0
+        while True:
+            token_ids = [token_id for token_id, in TokenBlocklist.select(TokenBlocklist.id)
+                         .where(TokenBlocklist.created_date < oldest)
+                         .order_by(TokenBlocklist.id)
+                         .limit(chunk_size)
+                         .tuples()]
+            if not token_ids:
+                break
+
+            purged += TokenBlocklist.delete().where(TokenBlocklist.id.in_(token_ids)).execute()
+
+        return purged
+
+    def migrate_preparation(self, chunk_size=500):
+        """ Rewrites every recipe preparation as compact JSON, reading the legacy pickle/str encodings """
+
+        last_id = 0
+        while True:
+            recipes = list(Recipe.select(Recipe.id, Recipe.preparation)
+                           .where(Recipe.id > last_id)
+                           .order_by(Recipe.id)
+                           .limit(chunk_size))
+            if not recipes:
+                break
+
+            # one UPDATE ... CASE per chunk, PreparationField encodes the decoded steps as JSON
+            with Recipe._meta.database.atomic():
+                Recipe.bulk_update(recipes, fields=[Recipe.preparation])
+
+            last_id = recipes[-1].id
+
+    def renormalize_quantities(self, chunk_size=1000, workers=None, dry_run=False, checkpoint=None, report=None):
+        """
+        Recomputes the normalized columns of every RecipeIngredientQuantity with the current normalize_quantity.
+        Chunks are read in id order and parsed by a pool of processes, changed rows are written with one
+        UPDATE ... CASE per chunk. checkpoint is a file holding the last written id, so a stopped run resumes
+        where it left off. dry_run writes nothing, report gets a csv line for every row that would change.
+        Returns the number of rows read, changed and unparseable.
+        """
+
+        last_id = 0
+        if checkpoint and not dry_run and os.path.exists(checkpoint):
+            with open(checkpoint) as checkpoint_file:
+                last_id = int(checkpoint_file.read().strip() or 0)
+            log.info(f"Resuming renormalize_quantities after id {last_id}.")
+
+        report_writer = csv.writer(report) if report else None
+        if report_writer:
+            report_writer.writerow(["id", "quantity_original", "old", "new"])
+
+        columns = [RecipeIngredientQuantity.units_normalized, RecipeIngredientQuantity.quantity_normalized,
+                   RecipeIngredientQuantity.extra_units, RecipeIngredientQuantity.extra_quantity]
+
+        stats = {"read": 0, "changed": 0, "failed": 0}
+        pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+        try:
+            while True:
+                rows = list(RecipeIngredientQuantity
+                            .select(RecipeIngredientQuantity.id, RecipeIngredientQuantity.quantity_original, *columns)
+                            .where(RecipeIngredientQuantity.id > last_id)
+                            .order_by(RecipeIngredientQuantity.id)
+                            .limit(chunk_size)
+                            .tuples())
+                if not rows:
+                    break
+
+                # a catalog repeats the same few strings, each one is parsed once per chunk
+                quantities = list({row[1] for row in rows})
+                parsed = pool.map(_normalize_or_none, quantities, chunksize=64) if pool else \
+                    map(_normalize_or_none, quantities)
+                normalized = dict(zip(quantities, parsed))
+
+                changed = {}
+                for row_id, quantity_original, *old in rows:
+                    new = normalized[quantity_original]
+                    if new is None:
+                        stats["failed"] += 1
+                    elif not _same_quantity(old, new):
+                        changed[row_id] = new
+                        if report_writer:
+                            report_writer.writerow([row_id, quantity_original, old, list(new)])
+
+                if changed and not dry_run:
+                    ids = list(changed)
+                    with RecipeIngredientQuantity._meta.database.atomic():
+                        RecipeIngredientQuantity.update({
+                            column: Case(RecipeIngredientQuantity.id,
+                                         [(row_id, changed[row_id][position]) for row_id in ids])
+                            for position, column in enumerate(columns)
+                        }).where(RecipeIngredientQuantity.id.in_(ids)).execute()
+
+                stats["read"] += len(rows)
+                stats["changed"] += len(changed)
+                last_id = rows[-1][0]
+
+                if checkpoint and not dry_run:
+                    with open(checkpoint, "w") as checkpoint_file:
+                        checkpoint_file.write(str(last_id))
+        finally:
+            if pool:
+                pool.shutdown()
+
+        # a finished run starts from the beginning next time
+        if checkpoint and not dry_run and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        return stats
+
     def connect_db(self):
         if self.db.is_closed():
             self.db.connect()
@@ -1,27 +1,161 @@
-from datetime import timedelta
+import os
+import threading
+import time
+from datetime import timedelta, datetime
 
 from flask_jwt_extended import JWTManager
-from peewee import DoesNotExist
+from peewee import DatabaseError
 
-from flask_app.classes.models import TokenBlocklist
+from flask_app.classes.models import TokenBlocklist, User
+from flask_app.ext.cache import LRUCache, user_tag
+from flask_app.ext.logger import log
 
 ACCESS_EXPIRES = timedelta(hours=1)
+# tokens given by POST /auth/login
+LOGIN_EXPIRES = timedelta(days=7)
+# no token is accepted past this age, neither its blocklist row is needed
+TOKEN_MAX_LIFETIME = max(ACCESS_EXPIRES, LOGIN_EXPIRES)
+
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES')) if os.environ.get('USER_CACHE_MAX_ENTRIES') else 10000
+# seconds a user row is reused, 0 (the default) reads it on every request. invalidate_user only reaches the
+# worker it runs on, so with a TTL the other workers may serve a changed user for that long
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL')) if os.environ.get('USER_CACHE_TTL') else 0
+# seconds a logout on another worker may take to reach this one, 0 reads the blocklist on every token check
+REVOKED_REFRESH_INTERVAL = int(os.environ.get('REVOKED_REFRESH_INTERVAL')) if os.environ.get('REVOKED_REFRESH_INTERVAL') else 5
+# a refresh reads again this far behind the watermark, rows may commit after a newer one was read
+REVOKED_OVERLAP = timedelta(minutes=1)
 
 jwt = JWTManager()
 
+# columns of the authenticated users by id, kept per worker. Only the row is cached, every request gets
+# its own User instance. It may be stale, handlers writing the user read it again and save only what they change.
+user_cache = LRUCache(max_entries=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL)
+
+
+def invalidate_user(user_id):
+    """ Drops the cached row of a user, call it after the user is changed or deleted """
+    user_cache.invalidate([user_tag(user_id)])
+
+
+class RevokedTokens:
+    """
+    jti of the tokens revoked in the last TOKEN_MAX_LIFETIME, the only ones that could still be presented, kept
+    per worker so checking a token is a set lookup. Every REVOKED_REFRESH_INTERVAL seconds a background thread
+    reads the rows created since the last one seen, tokens revoked on this worker are added right away.
+    """
+
+    def __init__(self, refresh_interval=REVOKED_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._jtis = {}
+        self._watermark = None
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        # a single first load when requests arrive before any refresh succeeded
+        self._load_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def refresh(self):
+        oldest = datetime.now() - TOKEN_MAX_LIFETIME
+        since = oldest if self._watermark is None else max(oldest, self._watermark - REVOKED_OVERLAP)
+        rows = list(TokenBlocklist
+                    .select(TokenBlocklist.jti, TokenBlocklist.created_date)
+                    .where(TokenBlocklist.created_date >= since)
+                    .tuples())
+
+        with self._lock:
+            for jti, created_date in rows:
+                self._jtis[jti] = created_date
+                if self._watermark is None or created_date > self._watermark:
+                    self._watermark = created_date
+            # tokens revoked before oldest have expired by now
+            self._jtis = {jti: created_date for jti, created_date in self._jtis.items() if created_date >= oldest}
+            self._refreshed_at = time.monotonic()
+
+        return len(rows)
+
+    def add(self, jti, created_date):
+        with self._lock:
+            self._jtis[jti] = created_date
+
+    def start(self):
+        """ Starts the refreshing thread of this process, every gunicorn worker builds its own app """
+        if not self.refresh_interval:
+            return
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(target=self._run, name="revoked-tokens", daemon=True)
+        self._thread_pid = os.getpid()
+        self._thread.start()
+
+    def _run(self):
+        database = TokenBlocklist._meta.database
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                # the set keeps what it has, the next round tries again
+                log.error(f"Revoked tokens couldn't be refreshed: {e}")
+            finally:
+                # the connection of this thread isn't kept open between refreshes
+                if not database.is_closed():
+                    database.close()
 
-# Callback function to check if a JWT exists in the database blocklist
+    def __contains__(self, jti):
+        if not self.refresh_interval:
+            # no refreshing thread, the blocklist is read on every check
+            self.refresh()
+        elif self._refreshed_at is None:
+            # nothing loaded yet, e.g. the database wasn't migrated when the worker started
+            with self._load_lock:
+                if self._refreshed_at is None:
+                    self.refresh()
+        return jti in self._jtis
+
+
+revoked_tokens = RevokedTokens()
+
+
+def revoke_token(jwt_payload: dict):
+    """ Adds the token to the blocklist, at logout or when its user no longer exists """
+    token_block_record = TokenBlocklist.create(jti=jwt_payload["jti"])
+    revoked_tokens.add(token_block_record.jti, token_block_record.created_date)
+
+
+# Callback function to check if a JWT is in the blocklist
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_header, jwt_payload: dict) -> bool:
-    jti = jwt_payload["jti"]
-    try:
-        TokenBlocklist.get(jti=jti)
-    except DoesNotExist:
-        return False
-    return True
+    return jwt_payload["jti"] in revoked_tokens
+
+
+# Loads the user of the token once per request, handlers read it from current_user.
+# None raises UserLookupError, answered with a 400 by the restapi.
+@jwt.user_lookup_loader
+def load_current_user(jwt_header, jwt_payload: dict):
+    user_id = str(jwt_payload["sub"])
+
+    data = user_cache.get(user_id) if USER_CACHE_TTL else None
+    if data is not None:
+        user = User(**data)
+        user._dirty.clear()
+        return user
+
+    generation = user_cache.generation()
+    user = User.get_or_none(User.id == user_id)
+    if user is not None and USER_CACHE_TTL:
+        user_cache.set(user_id, dict(user.__data__), (user_tag(user_id),), generation)
+    return user
 
 
 def init_app(app):
     jwt.init_app(app)
     app.config["JWT_ACCESS_TOKEN_EXPIRES"] = ACCESS_EXPIRES
     app.config["JWT_SECRET_KEY"] = 'super-secret'  # Change this to a secure secret key in production
+    try:
+        log.info(f"Loaded {revoked_tokens.refresh()} revoked tokens.")
+    except DatabaseError as e:
+        # a database flask migrate hasn't created yet, the first request loads them
+        log.error(f"Revoked tokens couldn't be loaded: {e}")
+    revoked_tokens.start()
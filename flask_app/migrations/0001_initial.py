@@ -0,0 +1,12 @@
+""" The tables of the first release, everything else is added by the migrations after this one """
+
+from flask_app.classes.models import TokenBlocklist, NutritionInformation, Recipe, RecipeRating, RecipeBackground, \
+    Tag, User, RecipeTagThrough, Comment, Follow, Ingredient, RecipeIngredientQuantity, CalendarEntry, FollowRequest, \
+    Notification, ShoppingIngredient, ShoppingList, RecipeReport, ApplicationReport, Goal
+from .operations import create_tables
+
+
+def migrate(database):
+    create_tables(TokenBlocklist, NutritionInformation, Recipe, RecipeRating, RecipeBackground, Tag, User,
+                  RecipeTagThrough, Comment, Follow, Ingredient, RecipeIngredientQuantity, CalendarEntry,
+                  FollowRequest, Notification, ShoppingIngredient, ShoppingList, RecipeReport, ApplicationReport, Goal)
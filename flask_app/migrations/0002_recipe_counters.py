@@ -0,0 +1,17 @@
+""" Denormalized engagement counters, the rating average and the random rank of the recipes, with their indexes """
+
+from flask_app.classes.models import Recipe
+from .operations import add_columns, add_indexes
+
+COUNTERS = ("likes_count", "saves_count", "comments_count", "rating_sum", "rating_count", "rating_average")
+
+
+def migrate(database):
+    added = add_columns(Recipe, *COUNTERS, "random_rank")
+    add_indexes(Recipe, ("likes_count",), ("saves_count",), ("rating_average",), ("random_rank",))
+
+    # the new columns of the existing recipes start at 0
+    if set(added) & set(COUNTERS):
+        database.recount_recipes()
+    if "random_rank" in added:
+        database.shuffle_recipes()
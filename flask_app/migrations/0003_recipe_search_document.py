@@ -0,0 +1,13 @@
+""" Accent folded search documents of the recipes and their FULLTEXT indexes """
+
+from flask_app.classes import search
+from flask_app.classes.models import RecipeSearchDocument
+from .operations import create_tables
+
+
+def migrate(database):
+    create_tables(RecipeSearchDocument)
+    # MySQL can't build the first FULLTEXT index of a table online, the table is still empty here
+    search.ensure_fulltext_indexes()
+    # recipes saved before the table existed have no document
+    search.rebuild_index()
@@ -0,0 +1,8 @@
+""" Indexes of the revoked tokens set of ext.jwt, read by jti and created_date """
+
+from flask_app.classes.models import TokenBlocklist
+from .operations import add_indexes
+
+
+def migrate(database):
+    add_indexes(TokenBlocklist, ("jti",), ("created_date",))
@@ -0,0 +1,11 @@
+""" Accent folded username and name words of the users, searched by prefix """
+
+from flask_app.classes import search
+from flask_app.classes.models import UserSearchToken
+from .operations import create_tables
+
+
+def migrate(database):
+    create_tables(UserSearchToken)
+    # users saved before the table existed have no tokens
+    search.rebuild_user_index()
@@ -0,0 +1,9 @@
+""" Indexes of the follower, followed and follow request lists, read by user and follow date """
+
+from flask_app.classes.models import Follow, FollowRequest
+from .operations import add_indexes
+
+
+def migrate(database):
+    add_indexes(Follow, ("followed", "created_date"), ("follower", "created_date"))
+    add_indexes(FollowRequest, ("followed", "created_date"))
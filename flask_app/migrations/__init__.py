@@ -0,0 +1,95 @@
+import importlib
+import os
+import pkgutil
+import re
+
+from peewee import DatabaseError, fn
+
+from flask_app.classes.models import SchemaVersion
+from flask_app.ext.logger import log
+
+# seconds flask migrate waits for a migration running on another container
+MIGRATION_LOCK_TIMEOUT = int(os.environ.get('MIGRATION_LOCK_TIMEOUT')) if os.environ.get('MIGRATION_LOCK_TIMEOUT') else 600
+MIGRATION_LOCK = "flask_api_migrations"
+
+# modules named like 0002_recipe_counters.py, applied in version order
+MIGRATION_MODULE = re.compile(r"^(\d{4})_(\w+)$")
+
+
+class Migration:
+    """ A module of this package with a migrate(database) function, database is the ext.database.Database """
+
+    def __init__(self, version, name, module_name):
+        self.version = version
+        self.name = name
+        self.module_name = module_name
+
+    def migrate(self, database):
+        importlib.import_module(f"{__name__}.{self.module_name}").migrate(database)
+
+
+def migrations():
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        match = MIGRATION_MODULE.match(module.name)
+        if match:
+            found.append(Migration(int(match.group(1)), match.group(2), module.name))
+    return sorted(found, key=lambda migration: migration.version)
+
+
+# the version the code was written for, read from the file names only
+LATEST_VERSION = max([migration.version for migration in migrations()], default=0)
+
+
+def current_version():
+    """ The version of the database, 0 before the first migration. A single query, workers run it at startup """
+    try:
+        return SchemaVersion.select(fn.MAX(SchemaVersion.version)).scalar() or 0
+    except DatabaseError:
+        # no schema_version table yet
+        return 0
+
+
+def applied():
+    """ Applied date by version """
+    if not SchemaVersion.table_exists():
+        return {}
+    return dict(SchemaVersion.select(SchemaVersion.version, SchemaVersion.applied_date).tuples())
+
+
+def status():
+    """ (version, name, applied date or None) of every migration """
+    done = applied()
+    return [(migration.version, migration.name, done.get(migration.version)) for migration in migrations()]
+
+
+def migrate(database, target=None):
+    """
+    Applies the migrations not applied yet, up to target, and returns their versions. Each one is recorded
+    as soon as it finishes, MySQL commits DDL statements on its own so a failed migration is run again in
+    full by the next flask migrate and must not fail on what it already did.
+    """
+
+    connection = SchemaVersion._meta.database
+    # two containers starting together would apply the same migrations twice
+    locked, = connection.execute_sql("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT)).fetchone()
+    if not locked:
+        raise RuntimeError(f"Another migration is still running after {MIGRATION_LOCK_TIMEOUT} seconds.")
+
+    try:
+        SchemaVersion.create_table(safe=True)
+        done = applied()
+
+        versions = []
+        for migration in migrations():
+            if migration.version in done or (target is not None and migration.version > target):
+                continue
+
+            log.info(f"Applying migration {migration.version:04d} {migration.name}.")
+            migration.migrate(database)
+            SchemaVersion.create(version=migration.version, name=migration.name)
+            versions.append(migration.version)
+
+        return versions
+    finally:
+        connection.execute_sql("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
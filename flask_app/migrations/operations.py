@@ -0,0 +1,68 @@
+"""
+Schema changes for the migrations. Columns and indexes are added with ALGORITHM=INPLACE, LOCK=NONE so the
+table keeps taking reads and writes while MySQL builds them; a change that can't be made online fails
+instead of locking the table. Everything already in the database is skipped, a database made by
+create_tables with the current models, or a migration stopped half way, only gets what it is missing.
+"""
+
+
+def _quote(name):
+    return f"`{name}`"
+
+
+def _alter_online(model, clauses):
+    database = model._meta.database
+    database.execute_sql(f"ALTER TABLE {_quote(model._meta.table_name)} {', '.join(clauses)}, "
+                         f"ALGORITHM=INPLACE, LOCK=NONE")
+
+
+def create_tables(*models):
+    """ Creates the missing tables with their indexes, returns the models whose table was created """
+    created = [model for model in models if not model.table_exists()]
+    if created:
+        created[0]._meta.database.create_tables(created)
+    return created
+
+
+def add_columns(model, *field_names):
+    """ Adds the missing columns of model fields in one ALTER TABLE, returns the names of the added ones """
+
+    database = model._meta.database
+    existing = {column.name for column in database.get_columns(model._meta.table_name)}
+    fields = [model._meta.fields[name] for name in field_names if model._meta.fields[name].column_name not in existing]
+    if not fields:
+        return []
+
+    context = database.get_sql_context()
+    for position, field in enumerate(fields):
+        if position:
+            context.literal(", ")
+        context.literal("ADD COLUMN ").sql(field.ddl(context))
+    _alter_online(model, [context.query()[0]])
+
+    return [field.name for field in fields]
+
+
+def add_indexes(model, *indexes):
+    """
+    Adds the missing indexes declared by model, each one given by its field names, e.g.
+    add_indexes(Recipe, ("likes_count",), ("created_by", "id")). Returns the names of the added ones.
+    """
+
+    database = model._meta.database
+    existing = {index.name for index in database.get_indexes(model._meta.table_name)}
+    declared = {tuple(field.name for field in index._expressions): index for index in model._meta.fields_to_index()}
+
+    clauses, added = [], []
+    for field_names in indexes:
+        index = declared[tuple(field_names)]
+        if index._name in existing:
+            continue
+
+        columns = ", ".join(_quote(field.column_name) for field in index._expressions)
+        clauses.append(f"ADD {'UNIQUE ' if index._unique else ''}INDEX {_quote(index._name)} ({columns})")
+        added.append(index._name)
+
+    if clauses:
+        _alter_online(model, clauses)
+    return added
@@ -4,6 +4,8 @@ from flask_app.ext import commands
 from flask_app.ext import application
 from flask_app.ext import jwt
 from flask_app.ext import bycrypt
+from flask_app.ext import cache
+from flask_app.ext import views
 from flask_app.ext.database import Database
 from flask_app.blueprints import restapi
 
@@ -16,6 +18,8 @@ def create_run():
     schema.init_app(app)
     restapi.init_app(app)
     bycrypt.init_app(app)
+    cache.init_app(app)
+    views.init_app(app)
     return app,db
 
 
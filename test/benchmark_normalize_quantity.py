@@ -0,0 +1,42 @@
+"""
+    Throughput of normalize_quantity over the golden corpus, run from the project root:
+
+        python test/benchmark_normalize_quantity.py [rounds]
+
+    cold clears the memoization before every pass, warm is the steady state of a worker.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_app.classes.functions import normalize_quantity
+from test_normalize_quantity import load_corpus
+
+
+def run_pass(quantities):
+    for quantity_original in quantities:
+        try:
+            normalize_quantity(quantity_original)
+        except ValueError:
+            pass
+
+
+def cold_pass(quantities):
+    normalize_quantity.cache_clear()
+    run_pass(quantities)
+
+
+def main(rounds=2000):
+    quantities = [item["quantity_original"] for item in load_corpus()]
+
+    for name, function in (("cold", cold_pass), ("warm", run_pass)):
+        seconds = timeit.timeit(lambda: function(quantities), number=rounds)
+        calls = rounds * len(quantities)
+        print(f"{name}: {calls / seconds:,.0f} quantities/s ({seconds * 1e6 / calls:.2f} us each)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,56 @@
+import json
+import os
+import sys
+import unittest
+
+# unlike the endpoint tests this one needs no running server, run it from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_app.classes.functions import normalize_quantity
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quantity_corpus.json")
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as corpus:
+        return json.load(corpus)
+
+
+class NormalizeQuantityTest(unittest.TestCase):
+
+    def test_golden_corpus(self):
+
+        """
+            Every quantity_original of the corpus normalizes to its expected (units, value, extra_units, extra_value),
+            expected null means it must raise ValueError
+        """
+
+        for item in load_corpus():
+            with self.subTest(quantity_original=item["quantity_original"]):
+                if item["expected"] is None:
+                    with self.assertRaises(ValueError):
+                        normalize_quantity(item["quantity_original"])
+                    continue
+
+                units, value, extra_units, extra_value = normalize_quantity(item["quantity_original"])
+                expected_units, expected_value, expected_extra_units, expected_extra_value = item["expected"]
+
+                self.assertEqual(expected_units, units)
+                self.assertAlmostEqual(expected_value, value, places=3)
+                self.assertEqual(expected_extra_units, extra_units)
+                if expected_extra_value is None:
+                    self.assertIsNone(extra_value)
+                else:
+                    self.assertAlmostEqual(expected_extra_value, extra_value, places=3)
+
+    def test_always_returns_a_tuple(self):
+
+        """ callers unpack the result, errors must raise instead of returning -1 """
+
+        for quantity_original in ["x c. de chá", "c. de sopa", "abc"]:
+            with self.assertRaises(ValueError):
+                normalize_quantity(quantity_original)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+# unlike the endpoint tests this one needs no running server, run it from the project root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peewee import SqliteDatabase
+
+from flask_app.classes.models import Recipe, User, NutritionInformation
+
+MODELS = [User, NutritionInformation, Recipe]
+
+
+class RecipeCountersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = SqliteDatabase(":memory:")
+        self.database.bind(MODELS)
+        self.database.create_tables(MODELS)
+
+        user = User.create(name="John Doe", username="john", birth_date=datetime(2000, 1, 1), email="john@doe.com",
+                           password="x", age=20)
+        self.recipe = Recipe.create(title="Soup", description="", preparation=[], created_by=user)
+
+    def tearDown(self):
+        self.database.close()
+
+    def test_rating_average_reads_the_stored_counters(self):
+
+        """
+            The average is set from the rating_sum and rating_count columns as stored, never from the
+            deltas added to them, MySQL applies a SET list left to right with the new values
+        """
+
+        sql, _ = Recipe.rating_average_update(self.recipe.id).sql()
+
+        self.assertIn('"recipe"."rating_sum" * ', sql)
+        self.assertIn('NULLIF("recipe"."rating_count", ', sql)
+        self.assertNotIn("+", sql)
+
+    def test_rating_average_after_ratings(self):
+
+        """
+            Ratings of 4 and 1 average 2.5, removing the 1 leaves 4.0, removing both leaves 0
+        """
+
+        Recipe.update_counters(self.recipe.id, rating_count=1, rating_sum=4)
+        Recipe.update_counters(self.recipe.id, rating_count=1, rating_sum=1)
+        self.assertEqual(2.5, Recipe.get_by_id(self.recipe.id).rating_average)
+
+        Recipe.update_counters(self.recipe.id, rating_count=-1, rating_sum=-1)
+        self.assertEqual(4.0, Recipe.get_by_id(self.recipe.id).rating_average)
+
+        Recipe.update_counters(self.recipe.id, rating_count=-1, rating_sum=-4)
+        self.assertEqual(0, Recipe.get_by_id(self.recipe.id).rating_average)
+
+    def test_other_counters_leave_the_average(self):
+        Recipe.update_counters(self.recipe.id, rating_count=1, rating_sum=3)
+        Recipe.update_counters(self.recipe.id, likes_count=1)
+
+        recipe = Recipe.get_by_id(self.recipe.id)
+        self.assertEqual(1, recipe.likes_count)
+        self.assertEqual(3.0, recipe.rating_average)
+
+
+if __name__ == '__main__':
+    unittest.main()